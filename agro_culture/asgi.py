@@ -3,6 +3,10 @@ ASGI config for agro_culture project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the project through this module (e.g. with uvicorn or daphne) to get
+the live badge stream at /live/badges/; under WSGI that endpoint answers
+204 and pages fall back to polling.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
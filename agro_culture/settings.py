@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'marketplace.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,6 +81,28 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Transactions take the write lock at BEGIN, so they queue for it
+        # (up to timeout seconds) instead of failing with "database is
+        # locked" when a read-then-write transaction can't upgrade its lock
+        'OPTIONS': {'timeout': 20, 'transaction_mode': 'IMMEDIATE'},
+        # A file rather than SQLite's shared in-memory database, which locks
+        # whole tables, so the concurrency tests see real lock behaviour; named
+        # per process so concurrent test runs don't share it
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), f'agro_culture_test_{os.getpid()}.sqlite3')},
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Shared by every worker process, so invalidating a buyer's cached flags or
+# the facet generation is seen by all of them; SQLite keeps the app on one
+# host, where a directory is enough
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
     }
 }
 
@@ -122,6 +148,13 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    # Product photos, stored once per distinct content under their SHA-256
+    'product_images': {'BACKEND': 'marketplace.storage.ContentAddressedStorage'},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -1,14 +1,19 @@
 from django.contrib import admin
-from .models import Product, Order, UserProfile, Wishlist, Review, Notification, Cart
+from .models import Product, OrderHeader, Order, UserProfile, Wishlist, Review, Notification, Cart, SalesRollup, StockHold, IdempotencyKey, NotificationCounter, OutboxEvent, ArchivedNotification, StoredFile
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
 	list_display = ('name', 'category', 'price', 'quantity', 'farmer')
 	search_fields = ('name', 'category', 'farmer__username')
 
+@admin.register(OrderHeader)
+class OrderHeaderAdmin(admin.ModelAdmin):
+	list_display = ('id', 'buyer', 'line_count', 'total_amount', 'created_date')
+	search_fields = ('buyer__username',)
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-	list_display = ('id', 'buyer', 'product', 'quantity', 'order_date')
+	list_display = ('id', 'header', 'buyer', 'product', 'quantity', 'unit_price', 'order_date')
 	search_fields = ('buyer__username', 'product__name')
 
 @admin.register(Wishlist)
@@ -32,3 +37,40 @@ class NotificationAdmin(admin.ModelAdmin):
 class CartAdmin(admin.ModelAdmin):
 	list_display = ('user', 'product', 'quantity', 'added_date')
 	search_fields = ('user__username', 'product__name')
+
+@admin.register(SalesRollup)
+class SalesRollupAdmin(admin.ModelAdmin):
+	list_display = ('day', 'farmer', 'product', 'category', 'units_sold', 'revenue')
+	list_filter = ('day', 'category')
+	search_fields = ('farmer__username', 'product__name')
+
+@admin.register(StockHold)
+class StockHoldAdmin(admin.ModelAdmin):
+	list_display = ('user', 'product', 'quantity', 'expires_at')
+	search_fields = ('user__username', 'product__name')
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+	list_display = ('user', 'path', 'key', 'status_code', 'created_date', 'expires_at')
+	search_fields = ('user__username', 'key', 'path')
+
+@admin.register(NotificationCounter)
+class NotificationCounterAdmin(admin.ModelAdmin):
+	list_display = ('user', 'unread')
+	search_fields = ('user__username',)
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+	list_display = ('id', 'kind', 'created_date', 'processed_date', 'attempts')
+	list_filter = ('kind',)
+	search_fields = ('last_error',)
+
+@admin.register(ArchivedNotification)
+class ArchivedNotificationAdmin(admin.ModelAdmin):
+	list_display = ('user', 'created_date', 'archived_date')
+	search_fields = ('user__username', 'message')
+
+@admin.register(StoredFile)
+class StoredFileAdmin(admin.ModelAdmin):
+	list_display = ('name', 'size', 'references', 'created_date')
+	search_fields = ('name',)
@@ -0,0 +1,63 @@
+"""Farmer dashboard sales figures, one grouped query per figure."""
+from django.db import connection
+from django.db.models import DecimalField, F, Sum
+
+from .models import OrderHeader, Order, Product, UserProfile
+
+REVENUE_FIELD = DecimalField(max_digits=14, decimal_places=2)
+
+
+def product_sales(farmer):
+	"""Return {product_id: {'units': int, 'revenue': Decimal, 'category': str}} for products with orders."""
+	rows = (
+		Order.objects.filter(product__farmer=farmer)
+		.values('product_id', 'product__category')
+		.annotate(
+			units=Sum('quantity'),
+			revenue=Sum(F('quantity') * F('unit_price'), output_field=REVENUE_FIELD),
+		)
+		.order_by()
+	)
+	return {
+		row['product_id']: {'units': row['units'], 'revenue': row['revenue'], 'category': row['product__category']}
+		for row in rows
+	}
+
+
+def farmer_summary(farmer, products):
+	"""Build the farmer dashboard sales context for an already-fetched product list."""
+	sales = product_sales(farmer)
+	total_sales = {}
+	category_sales = {}
+	for product in products:
+		units = sales.get(product.id, {}).get('units', 0)
+		total_sales[product.id] = units
+		category_sales[product.category] = category_sales.get(product.category, 0) + units
+	
+	total_products_sold = sum(row['units'] for row in sales.values())
+	total_revenue = sum((row['revenue'] for row in sales.values()), 0)
+	top_category = max(category_sales, key=category_sales.get) if category_sales else 'N/A'
+	return {
+		'total_sales': total_sales,
+		'total_products_sold': total_products_sold,
+		'total_revenue': total_revenue,
+		'category_sales': category_sales,
+		'top_category': top_category,
+	}
+
+
+def marketplace_totals():
+	"""Headline counts for the admin summary, fetched with one statement of scalar subqueries."""
+	profiles = UserProfile._meta.db_table
+	sql = (
+		f"SELECT (SELECT COUNT(*) FROM {OrderHeader._meta.db_table}),"
+		f" (SELECT COUNT(*) FROM {profiles}),"
+		f" (SELECT COUNT(*) FROM {profiles} WHERE role = %s),"
+		f" (SELECT COUNT(*) FROM {profiles} WHERE role = %s),"
+		f" (SELECT COUNT(*) FROM {Product._meta.db_table})"
+	)
+	with connection.cursor() as cursor:
+		cursor.execute(sql, ['Farmer', 'Buyer'])
+		row = cursor.fetchone()
+	keys = ('total_transactions', 'total_users', 'total_farmers', 'total_buyers', 'total_products')
+	return dict(zip(keys, row))
@@ -0,0 +1,147 @@
+"""Buyer cart operations and totals, kept in step with stock holds (see inventory.py)."""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum, Value, Window
+from django.db.models.functions import Coalesce
+
+from . import inventory, live
+from .models import Product, Cart
+
+LINE_TOTAL = ExpressionWrapper(F('quantity') * F('product__price'), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+# Most operations accepted in one batch request
+MAX_OPERATIONS = 50
+
+
+class CartError(Exception):
+	def __init__(self, message, status=400):
+		super().__init__(message)
+		self.message = message
+		self.status = status
+
+
+def lines(user):
+	"""Return the user's cart lines with product, line_total and the cart-wide totals on each row."""
+	return (
+		Cart.objects.filter(user=user)
+		.select_related('product', 'product__farmer')
+		.annotate(
+			line_total=LINE_TOTAL,
+			cart_subtotal=Window(Sum(LINE_TOTAL)),
+			cart_items=Window(Sum('quantity')),
+		)
+		.order_by('id')
+	)
+
+
+def totals(user, cart_lines=None):
+	"""Return {'cart_count', 'total_items', 'subtotal'}, from already fetched lines() when given."""
+	if cart_lines is not None:
+		cart_lines = list(cart_lines)
+		if not cart_lines:
+			return {'cart_count': 0, 'total_items': 0, 'subtotal': Decimal('0.00')}
+		return {
+			'cart_count': len(cart_lines),
+			'total_items': cart_lines[0].cart_items,
+			'subtotal': cart_lines[0].cart_subtotal,
+		}
+	return Cart.objects.filter(user=user).aggregate(
+		cart_count=Count('id'),
+		total_items=Coalesce(Sum('quantity'), 0),
+		subtotal=Coalesce(Sum(LINE_TOTAL), Value(Decimal('0.00')), output_field=DecimalField(max_digits=14, decimal_places=2)),
+	)
+
+
+def _get_line(user, cart_id):
+	try:
+		return Cart.objects.select_related('product').get(id=cart_id, user=user)
+	except Cart.DoesNotExist:
+		raise CartError('Cart item not found', status=404)
+
+
+def add(user, product_id, quantity=1):
+	"""Add quantity of a product, holding the line's whole quantity. Returns the Cart line."""
+	if quantity <= 0:
+		raise CartError('Invalid quantity')
+	try:
+		product = Product.objects.get(id=product_id)
+	except Product.DoesNotExist:
+		raise CartError('Product not found', status=404)
+	with transaction.atomic():
+		cart_item, created = Cart.objects.get_or_create(user=user, product=product, defaults={'quantity': quantity})
+		new_quantity = quantity if created else cart_item.quantity + quantity
+		# Hold the whole cart quantity against stock not held by other buyers
+		try:
+			inventory.hold(user, product, new_quantity)
+		except inventory.InsufficientStock as e:
+			prefix = '' if created else 'Cannot add more. '
+			raise CartError(f'{prefix}Only {e.available} items available')
+		if created:
+			live.changed([user.id], live.CART)
+		else:
+			cart_item.quantity = new_quantity
+			cart_item.save(update_fields=['quantity'])
+	return cart_item
+
+
+def update(user, cart_id, quantity):
+	"""Set a line's quantity and its stock hold. Returns the Cart line."""
+	if quantity <= 0:
+		raise CartError('Invalid quantity')
+	with transaction.atomic():
+		cart_item = _get_line(user, cart_id)
+		try:
+			inventory.hold(user, cart_item.product, quantity)
+		except inventory.InsufficientStock as e:
+			raise CartError(f'Only {e.available} items available')
+		cart_item.quantity = quantity
+		cart_item.save(update_fields=['quantity'])
+	return cart_item
+
+
+def remove(user, cart_id):
+	"""Delete a line and release its stock hold."""
+	with transaction.atomic():
+		cart_item = _get_line(user, cart_id)
+		cart_item.delete()
+		inventory.release(user, [cart_item.product_id])
+		live.changed([user.id], live.CART)
+
+
+def _int(operation, name, default=None):
+	value = operation.get(name, default)
+	try:
+		return int(value)
+	except (TypeError, ValueError):
+		raise CartError(f'Invalid {name}')
+
+
+def apply(user, operations):
+	"""Apply [{'op': 'add'|'update'|'remove', ...}, ...] in one transaction.
+
+	add takes product_id and quantity (default 1); update takes cart_id and
+	quantity; remove takes cart_id. Raises CartError, with the failing
+	operation's index in the message, and rolls back every operation if any
+	one of them fails.
+	"""
+	if not isinstance(operations, list) or not operations:
+		raise CartError('No operations given')
+	if len(operations) > MAX_OPERATIONS:
+		raise CartError(f'At most {MAX_OPERATIONS} operations can be applied at once')
+	with transaction.atomic():
+		for index, operation in enumerate(operations):
+			try:
+				if not isinstance(operation, dict):
+					raise CartError('Invalid operation')
+				op = operation.get('op')
+				if op == 'add':
+					add(user, _int(operation, 'product_id'), _int(operation, 'quantity', 1))
+				elif op == 'update':
+					update(user, _int(operation, 'cart_id'), _int(operation, 'quantity'))
+				elif op == 'remove':
+					remove(user, _int(operation, 'cart_id'))
+				else:
+					raise CartError(f'Unknown operation: {op}')
+			except CartError as e:
+				raise CartError(f'Operation {index + 1}: {e.message}', e.status)
@@ -0,0 +1,77 @@
+"""Buyer catalog queries: filtering and keyset (cursor) pagination."""
+from django.template.loader import render_to_string
+
+from . import search
+from .models import Product
+from .pagination import InvalidCursor, keyset_page  # noqa: F401
+
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# Sort name -> ordering; the trailing id makes every order total
+SORTS = {
+	'id': ('id',),
+	'price': ('price', 'id'),
+	'-price': ('-price', '-id'),
+	'rank': ('search_rank', 'id'),
+}
+SORT_CHOICES = [
+	('id', 'Default'),
+	('price', 'Price: low to high'),
+	('-price', 'Price: high to low'),
+]
+
+
+def filter_products(query='', category='', min_price='', max_price=''):
+	"""Apply the buyer filter form to Product; returns (queryset, ranked).
+
+	ranked says whether the queryset carries a search_rank to sort by.
+	"""
+	products = Product.objects.select_related('farmer')
+	ranked = False
+	if query:
+		products, ranked = search.filter_products(products, query)
+	if category:
+		products = products.filter(category=category)
+	if min_price:
+		try:
+			products = products.filter(price__gte=float(min_price))
+		except ValueError:
+			pass
+	if max_price:
+		try:
+			products = products.filter(price__lte=float(max_price))
+		except ValueError:
+			pass
+	return products, ranked
+
+
+def resolve_sort(sort, ranked):
+	if sort in SORTS and sort != 'rank':
+		return sort
+	return 'rank' if ranked else 'id'
+
+
+def paginate(products, sort='id', cursor=None, page_size=PAGE_SIZE):
+	"""Return (rows, next_cursor) for one keyset page of products."""
+	return keyset_page(products, SORTS[sort], cursor, page_size)
+
+
+def product_card(product, flags, request=None):
+	"""JSON-ready card for the infinite-scroll listing, including its rendered markup."""
+	context = dict(flags, product=product)
+	return {
+		'id': product.id,
+		'name': product.name,
+		'category': product.category,
+		'price': str(product.price),
+		'quantity': product.quantity,
+		'farmer': product.farmer.username,
+		'image_url': product.image.url if product.image else None,
+		'avg_rating': product.average_rating,
+		'rating_count': product.rating_count,
+		'wishlisted': product.id in flags['wishlist_ids'],
+		'purchased': product.id in flags['purchased_product_ids'],
+		'reviewed': product.id in flags['reviewed_product_ids'],
+		'html': render_to_string('includes/product_card.html', context, request=request),
+	}
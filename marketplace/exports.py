@@ -0,0 +1,129 @@
+"""Streaming CSV / NDJSON exports of marketplace data for the admin."""
+import csv
+import json
+from datetime import datetime, time
+
+from django.utils import timezone
+
+from .models import UserProfile, Product, Order
+
+CHUNK_SIZE = 2000
+FORMATS = {
+	'csv': 'text/csv',
+	'ndjson': 'application/x-ndjson',
+}
+
+
+def _iso(value):
+	return value.isoformat() if value else ''
+
+
+EXPORTS = {
+	'orders': {
+		'queryset': lambda: Order.objects.select_related('buyer', 'product', 'product__farmer'),
+		'date_field': 'order_date',
+		'status_field': 'status',
+		'columns': [
+			('order_id', lambda o: o.id),
+			('order_date', lambda o: _iso(o.order_date)),
+			('status', lambda o: o.status),
+			('buyer_id', lambda o: o.buyer_id),
+			('buyer', lambda o: o.buyer.username),
+			('buyer_email', lambda o: o.buyer.email),
+			('product_id', lambda o: o.product_id),
+			('product', lambda o: o.product.name),
+			('category', lambda o: o.product.category),
+			('order_header_id', lambda o: o.header_id),
+			('unit_price', lambda o: str(o.unit_price)),
+			('quantity', lambda o: o.quantity),
+			('farmer_id', lambda o: o.product.farmer_id),
+			('farmer', lambda o: o.product.farmer.username),
+		],
+	},
+	'products': {
+		'queryset': lambda: Product.objects.select_related('farmer'),
+		'date_field': None,
+		'status_field': None,
+		'columns': [
+			('product_id', lambda p: p.id),
+			('name', lambda p: p.name),
+			('category', lambda p: p.category),
+			('price', lambda p: str(p.price)),
+			('quantity', lambda p: p.quantity),
+			('rating_count', lambda p: p.rating_count),
+			('average_rating', lambda p: p.average_rating),
+			('farmer_id', lambda p: p.farmer_id),
+			('farmer', lambda p: p.farmer.username),
+		],
+	},
+	'users': {
+		'queryset': lambda: UserProfile.objects.select_related('user'),
+		'date_field': 'user__date_joined',
+		'status_field': 'role',
+		'columns': [
+			('user_id', lambda p: p.user_id),
+			('username', lambda p: p.user.username),
+			('email', lambda p: p.user.email),
+			('role', lambda p: p.role),
+			('date_joined', lambda p: _iso(p.user.date_joined)),
+			('last_login', lambda p: _iso(p.user.last_login)),
+			('is_active', lambda p: p.user.is_active),
+		],
+	},
+}
+
+
+def _parse_day(value):
+	if not value:
+		return None
+	try:
+		return datetime.strptime(value, '%Y-%m-%d').date()
+	except ValueError:
+		raise ValueError(f'Invalid date: {value} (expected YYYY-MM-DD)')
+
+
+def export_queryset(dataset, params):
+	"""Filtered, ordered queryset for an export; raises KeyError or ValueError on bad input."""
+	spec = EXPORTS[dataset]
+	queryset = spec['queryset']().order_by('pk')
+	start, end = _parse_day(params.get('start')), _parse_day(params.get('end'))
+	if (start or end) and spec['date_field']:
+		tz = timezone.get_current_timezone()
+		if start:
+			queryset = queryset.filter(**{spec['date_field'] + '__gte': datetime.combine(start, time.min, tz)})
+		if end:
+			queryset = queryset.filter(**{spec['date_field'] + '__lte': datetime.combine(end, time.max, tz)})
+	status = params.get('status')
+	if status and spec['status_field']:
+		queryset = queryset.filter(**{spec['status_field']: status})
+	return queryset
+
+
+# Leading characters that make spreadsheet apps read a cell as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def csv_cell(value):
+	# Quote user-entered text such as "=HYPERLINK(...)" so it opens as text
+	if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+		return "'" + value
+	return value
+
+
+class Echo:
+	# csv.writer needs a file; this one hands each written line straight back
+	def write(self, value):
+		return value
+
+
+def stream_rows(dataset, queryset, fmt):
+	columns = EXPORTS[dataset]['columns']
+	rows = queryset.iterator(chunk_size=CHUNK_SIZE)
+	if fmt == 'csv':
+		writer = csv.writer(Echo())
+		yield writer.writerow([name for name, _ in columns])
+		for obj in rows:
+			yield writer.writerow([csv_cell(value(obj)) for _, value in columns])
+	else:
+		for obj in rows:
+			yield json.dumps({name: value(obj) for name, value in columns}) + '\n'
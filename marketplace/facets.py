@@ -0,0 +1,92 @@
+"""Facet counts for the buyer catalog filters, cached per filter and dropped on product changes."""
+import hashlib
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db.models import Case, Count, IntegerField, When
+
+from . import catalog
+
+CACHE_TIMEOUT = 300
+GENERATION_KEY = 'facets:generation'
+
+# Upper edges of the price histogram buckets; the last bucket is open-ended
+PRICE_EDGES = [50, 100, 250, 500, 1000, 5000]
+
+
+def price_buckets():
+	buckets = []
+	lower = 0
+	for upper in PRICE_EDGES:
+		buckets.append({'min': lower, 'max': upper, 'label': f'₹{lower} - ₹{upper}'})
+		lower = upper
+	buckets.append({'min': lower, 'max': None, 'label': f'₹{lower}+'})
+	return buckets
+
+
+def _normalize_price(value):
+	try:
+		return str(Decimal(value).normalize()) if value not in (None, '') else ''
+	except InvalidOperation:
+		return ''
+
+
+def normalize(query='', category='', min_price='', max_price=''):
+	return (
+		' '.join((query or '').lower().split()),
+		category or '',
+		_normalize_price(min_price),
+		_normalize_price(max_price),
+	)
+
+
+def generation():
+	return cache.get_or_set(GENERATION_KEY, 1, None)
+
+
+def invalidate():
+	try:
+		cache.incr(GENERATION_KEY)
+	except ValueError:
+		cache.set(GENERATION_KEY, 1, None)
+
+
+def cache_key(filters):
+	digest = hashlib.sha1('\x1f'.join(filters).encode()).hexdigest()
+	return f'facets:{generation()}:{digest}'
+
+
+# Each facet ignores its own filter, so the other choices keep their counts
+def category_counts(query, min_price, max_price):
+	products, _ = catalog.filter_products(query, '', min_price, max_price)
+	rows = products.order_by().values('category').annotate(count=Count('id'))
+	return {row['category']: row['count'] for row in rows}
+
+
+def price_histogram(query, category):
+	products, _ = catalog.filter_products(query, category)
+	buckets = price_buckets()
+	bucket = Case(
+		*[When(price__lt=edge, then=index) for index, edge in enumerate(PRICE_EDGES)],
+		default=len(PRICE_EDGES),
+		output_field=IntegerField(),
+	)
+	counts = dict(products.order_by().annotate(bucket=bucket).values_list('bucket').annotate(count=Count('id')))
+	for index, entry in enumerate(buckets):
+		entry['count'] = counts.get(index, 0)
+	return buckets
+
+
+def compute_facets(query='', category='', min_price='', max_price=''):
+	"""Return {'categories': {category: count}, 'prices': [bucket, ...]} for the filter."""
+	filters = normalize(query, category, min_price, max_price)
+	key = cache_key(filters)
+	facets = cache.get(key)
+	if facets is None:
+		query, category, min_price, max_price = filters
+		facets = {
+			'categories': category_counts(query, min_price, max_price),
+			'prices': price_histogram(query, category),
+		}
+		cache.set(key, facets, CACHE_TIMEOUT)
+	return facets
@@ -0,0 +1,44 @@
+"""Order status changes made by farmers, one order or many at a time."""
+from django.db import transaction
+
+from . import outbox
+from .models import Order
+
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+NOT_FOUND = 'not_found'
+
+# Upper bound on one batch, keeping the id__in list well under SQLite's
+# bound-parameter limit
+MAX_BATCH = 500
+
+
+def set_status(farmer, order_ids, status):
+	"""Move the farmer's orders among order_ids to status.
+
+	Returns {order_id: UPDATED | UNCHANGED | NOT_FOUND}. Orders that belong
+	to another farmer's products are reported as NOT_FOUND, and orders
+	already in status are left alone without notifying the buyer again.
+	"""
+	order_ids = list(dict.fromkeys(order_ids))
+	results = dict.fromkeys(order_ids, NOT_FOUND)
+	with transaction.atomic():
+		owned = list(
+			Order.objects.select_for_update()
+			.filter(id__in=order_ids, product__farmer=farmer)
+			.only('id', 'status')
+		)
+		changed = []
+		for order in owned:
+			if order.status == status:
+				results[order.id] = UNCHANGED
+			else:
+				results[order.id] = UPDATED
+				changed.append(order)
+		if not changed:
+			return results
+
+		changed_ids = [order.id for order in changed]
+		Order.objects.filter(id__in=changed_ids).update(status=status)
+		outbox.record(outbox.ORDER_STATUS, order_ids=changed_ids, status=status)
+	return results
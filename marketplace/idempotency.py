@@ -0,0 +1,100 @@
+"""Idempotency keys for purchase-style POSTs: retries replay the first response."""
+import uuid
+from datetime import timedelta
+from functools import wraps
+
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+KEY_TTL = timedelta(hours=24)
+# How long an unfinished request holds its key; a claim left behind by a
+# crashed process becomes reclaimable after this
+LEASE = timedelta(minutes=5)
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+FIELD = 'idempotency_key'
+
+
+def new_key():
+	return uuid.uuid4().hex
+
+
+def request_key(request):
+	key = request.META.get(HEADER) or request.POST.get(FIELD) or ''
+	return key.strip()[:64]
+
+
+def _replay(record):
+	if record.location:
+		return HttpResponseRedirect(record.location, status=record.status_code)
+	response = HttpResponse(record.body, status=record.status_code, content_type=record.content_type)
+	response['Idempotent-Replay'] = 'true'
+	return response
+
+
+def _claim(user, key, path):
+	"""Return (record, claimed): claimed is False when another request owns the key."""
+	now = timezone.now()
+	try:
+		with transaction.atomic():
+			return IdempotencyKey.objects.create(user=user, key=key, path=path, expires_at=now + LEASE), True
+	except IntegrityError:
+		record = IdempotencyKey.objects.get(user=user, key=key)
+		if record.expires_at <= now:
+			# An expired key the purge command has not removed yet, or a claim
+			# whose request died before storing a response, is reusable
+			record.delete()
+			return _claim(user, key, path)
+		return record, False
+
+
+def idempotent(view):
+	@wraps(view)
+	def wrapper(request, *args, **kwargs):
+		if request.method != 'POST' or not request.user.is_authenticated:
+			return view(request, *args, **kwargs)
+		key = request_key(request)
+		if not key:
+			return view(request, *args, **kwargs)
+
+		record, claimed = _claim(request.user, key, request.path)
+		if not claimed:
+			if record.path != request.path:
+				return JsonResponse({'success': False, 'message': 'Idempotency key was used for another request'}, status=422)
+			if record.status_code is None:
+				return JsonResponse({'success': False, 'message': 'This request is already being processed'}, status=409)
+			return _replay(record)
+
+		try:
+			response = view(request, *args, **kwargs)
+		except Exception:
+			record.delete()
+			raise
+		if response.status_code >= 500 or getattr(response, 'streaming', False):
+			# Let the client retry failures for real
+			record.delete()
+			return response
+		location = response.get('Location', '') if 300 <= response.status_code < 400 else ''
+		# A no-op if the lease ran out and a retry has reclaimed the key meanwhile
+		IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True).update(
+			status_code=response.status_code,
+			content_type=response.get('Content-Type', ''),
+			location=location,
+			body='' if location else response.content.decode(response.charset or 'utf-8'),
+			expires_at=timezone.now() + KEY_TTL,
+		)
+		return response
+	return wrapper
+
+
+def purge_expired(batch_size=1000, now=None):
+	"""Delete expired keys batch by batch; returns how many were removed."""
+	now = now or timezone.now()
+	removed = 0
+	while True:
+		ids = list(IdempotencyKey.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+		if not ids:
+			return removed
+		removed += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
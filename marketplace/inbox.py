@@ -0,0 +1,111 @@
+"""Per-user notification inbox: unread counters, keyset paging and retention."""
+from collections import Counter
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import pagination
+from .models import Notification, NotificationCounter, ArchivedNotification
+
+PAGE_SIZE = 20
+PAGE_ORDERING = ('-created_date', '-id')
+READ_RETENTION = timedelta(days=90)
+
+
+def unread_count(user_id):
+	"""Return the user's unread notification count with a single primary-key lookup."""
+	return NotificationCounter.objects.filter(pk=user_id).values_list('unread', flat=True).first() or 0
+
+
+def add_unread(user_ids):
+	"""Count one new unread notification per occurrence of each id in user_ids."""
+	by_delta = {}
+	for user_id, delta in Counter(user_ids).items():
+		by_delta.setdefault(delta, set()).add(user_id)
+	# One UPDATE per distinct delta; usually every user gets one notification
+	for delta, ids in by_delta.items():
+		updated = NotificationCounter.objects.filter(pk__in=ids).update(unread=F('unread') + delta)
+		if updated < len(ids):
+			existing = set(NotificationCounter.objects.filter(pk__in=ids).values_list('pk', flat=True))
+			for user_id in ids - existing:
+				_create(user_id, delta)
+
+
+def _create(user_id, unread):
+	try:
+		with transaction.atomic():
+			NotificationCounter.objects.create(user_id=user_id, unread=unread)
+	except IntegrityError:
+		# Another transaction created the row first
+		NotificationCounter.objects.filter(pk=user_id).update(unread=F('unread') + unread)
+
+
+def mark_all_read(user_id):
+	"""Mark the user's unread notifications read and take them off the counter. Returns how many."""
+	with transaction.atomic():
+		marked = Notification.objects.filter(user_id=user_id, is_read=False).update(is_read=True)
+		if marked:
+			NotificationCounter.objects.filter(pk=user_id).update(unread=Greatest(F('unread') - marked, Value(0)))
+	return marked
+
+
+def reconcile(fix=True, batch_size=1000):
+	"""Compare every counter with a real COUNT of unread rows. Returns the number that were wrong."""
+	actual = dict(
+		Notification.objects.filter(is_read=False).values_list('user_id').annotate(count=Count('id')).order_by()
+	)
+	wrong = 0
+	with transaction.atomic():
+		stale = []
+		for counter in NotificationCounter.objects.iterator(chunk_size=batch_size):
+			unread = actual.pop(counter.pk, 0)
+			if counter.unread != unread:
+				counter.unread = unread
+				stale.append(counter)
+		wrong = len(stale) + len(actual)
+		if fix:
+			NotificationCounter.objects.bulk_update(stale, ['unread'], batch_size=batch_size)
+			# Users with unread notifications but no counter row yet
+			for user_id, unread in actual.items():
+				_create(user_id, unread)
+	return wrong
+
+
+def page(user_id, cursor=None, unread_only=False, page_size=PAGE_SIZE):
+	"""Return (notifications, next_cursor) for one inbox page, newest first.
+
+	Raises pagination.InvalidCursor for a cursor that was not issued here.
+	"""
+	notifications = Notification.objects.filter(user_id=user_id)
+	if unread_only:
+		notifications = notifications.filter(is_read=False)
+	return pagination.keyset_page(notifications, PAGE_ORDERING, cursor, page_size)
+
+
+def purge_read(older_than=READ_RETENTION, batch_size=1000, archive=False):
+	"""Delete (or archive) read notifications created before now - older_than. Returns how many.
+
+	Each batch is its own short transaction, so the purge never holds the
+	table locked for long and can be interrupted and rerun safely.
+	"""
+	cutoff = timezone.now() - older_than
+	removed = 0
+	while True:
+		with transaction.atomic():
+			batch = list(
+				Notification.objects.filter(is_read=True, created_date__lt=cutoff)
+				.order_by('id')
+				.values('id', 'user_id', 'message', 'created_date')[:batch_size]
+			)
+			if not batch:
+				return removed
+			if archive:
+				ArchivedNotification.objects.bulk_create([
+					ArchivedNotification(user_id=row['user_id'], message=row['message'], created_date=row['created_date'])
+					for row in batch
+				])
+			Notification.objects.filter(id__in=[row['id'] for row in batch]).delete()
+		removed += len(batch)
@@ -0,0 +1,71 @@
+"""Time-limited stock holds for cart lines."""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import IntegerField, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockHold
+
+HOLD_TTL = timedelta(minutes=15)
+
+
+class InsufficientStock(Exception):
+	def __init__(self, available):
+		super().__init__(f'Only {available} items available')
+		self.available = available
+
+
+def active_holds(product_id, exclude_user=None):
+	holds = StockHold.objects.filter(product_id=product_id, expires_at__gt=timezone.now())
+	if exclude_user is not None:
+		holds = holds.exclude(user=exclude_user)
+	return holds
+
+
+def held_by_others(product_id, buyer):
+	"""Subquery expression: units of product_id held by anyone but buyer."""
+	holds = StockHold.objects.filter(product_id=product_id, expires_at__gt=timezone.now())
+	if buyer is not None:
+		holds = holds.exclude(user=buyer)
+	total = holds.order_by().values('product_id').annotate(total=Sum('quantity')).values('total')
+	return Coalesce(Subquery(total, output_field=IntegerField()), Value(0))
+
+
+def available_quantity(product, buyer=None):
+	"""Stock not held by other buyers' carts."""
+	held = active_holds(product.id, exclude_user=buyer).aggregate(total=Sum('quantity'))['total'] or 0
+	return max(product.quantity - held, 0)
+
+
+def hold(user, product, quantity):
+	"""Reserve quantity units of product for user's cart, replacing any earlier hold.
+
+	Raises InsufficientStock when other buyers' holds leave too little.
+	"""
+	with transaction.atomic():
+		product = Product.objects.select_for_update().get(pk=product.pk)
+		available = available_quantity(product, buyer=user)
+		if quantity > available:
+			raise InsufficientStock(available)
+		StockHold.objects.update_or_create(
+			user=user,
+			product=product,
+			defaults={'quantity': quantity, 'expires_at': timezone.now() + HOLD_TTL},
+		)
+
+
+def release(user, product_ids):
+	StockHold.objects.filter(user=user, product_id__in=product_ids).delete()
+
+
+def sweep_expired(batch_size=1000, now=None):
+	"""Delete expired holds batch by batch; returns how many were removed."""
+	now = now or timezone.now()
+	removed = 0
+	while True:
+		ids = list(StockHold.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+		if not ids:
+			return removed
+		removed += StockHold.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,127 @@
+"""Live header badges pushed over Server-Sent Events.
+
+Changes made in the same process are pushed at once; streams also re-read
+the counters every RECHECK seconds to pick up changes made by other
+processes, such as the dispatch_outbox worker.
+"""
+import asyncio
+import json
+import threading
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from . import inbox
+from .models import Cart
+
+NOTIFICATIONS = 'notifications'
+CART = 'cart'
+
+# Topic -> (event field, counter)
+COUNTERS = {
+	NOTIFICATIONS: ('unread_count', inbox.unread_count),
+	CART: ('cart_count', lambda user_id: Cart.objects.filter(user_id=user_id).count()),
+}
+
+# Seconds between keep-alive comments, so proxies don't drop an idle stream
+KEEPALIVE = 25
+# Seconds between re-reads of the counters, for writes made in other processes
+RECHECK = 5
+# Milliseconds the browser waits before reconnecting a dropped stream
+RETRY_MS = 5000
+
+
+class Hub:
+	"""Per-user publish/subscribe of changed topics.
+
+	Subscribers are asyncio queues on an event loop; publish() may be called
+	from any thread, including the worker threads sync views run in.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.subscribers = {}
+
+	@contextmanager
+	def subscribe(self, user_id):
+		# Must be entered from the event loop that will read the queue
+		queue = asyncio.Queue()
+		subscriber = (asyncio.get_running_loop(), queue)
+		with self.lock:
+			self.subscribers.setdefault(user_id, set()).add(subscriber)
+		try:
+			yield queue
+		finally:
+			with self.lock:
+				subscribers = self.subscribers.get(user_id, set())
+				subscribers.discard(subscriber)
+				if not subscribers:
+					self.subscribers.pop(user_id, None)
+
+	def publish(self, user_id, topic):
+		with self.lock:
+			subscribers = list(self.subscribers.get(user_id, ()))
+		for loop, queue in subscribers:
+			try:
+				loop.call_soon_threadsafe(queue.put_nowait, topic)
+			except RuntimeError:
+				# The subscriber's loop has closed; it unsubscribes as it unwinds
+				pass
+
+	def subscriber_count(self, user_id=None):
+		with self.lock:
+			if user_id is not None:
+				return len(self.subscribers.get(user_id, ()))
+			return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+
+hub = Hub()
+
+
+def changed(user_ids, topic):
+	"""Publish topic for each user once the current transaction commits."""
+	user_ids = set(user_ids)
+	transaction.on_commit(lambda: [hub.publish(user_id, topic) for user_id in user_ids])
+
+
+def counts(user_id, topics=None):
+	"""Return {'unread_count': n, 'cart_count': n} for the given topics (all by default)."""
+	return {
+		field: counter(user_id)
+		for topic, (field, counter) in COUNTERS.items()
+		if topics is None or topic in topics
+	}
+
+
+def sse_event(data, event='badges'):
+	return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def badge_stream(user_id):
+	"""Yield SSE messages: current counts first, then each change as it happens."""
+	loop = asyncio.get_running_loop()
+	with hub.subscribe(user_id) as queue:
+		yield f'retry: {RETRY_MS}\n\n'
+		sent = await sync_to_async(counts)(user_id)
+		yield sse_event(sent)
+		last_message = loop.time()
+		while True:
+			try:
+				topics = {await asyncio.wait_for(queue.get(), RECHECK)}
+			except asyncio.TimeoutError:
+				# Nothing published here; only push counters another process changed
+				current = await sync_to_async(counts)(user_id)
+				update = {field: value for field, value in current.items() if sent.get(field) != value}
+			else:
+				# Coalesce a burst of changes into one recount
+				while not queue.empty():
+					topics.add(queue.get_nowait())
+				update = await sync_to_async(counts)(user_id, topics)
+			if update:
+				sent.update(update)
+				yield sse_event(update)
+				last_message = loop.time()
+			elif loop.time() - last_message >= KEEPALIVE:
+				yield ': keep-alive\n\n'
+				last_message = loop.time()
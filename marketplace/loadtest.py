@@ -0,0 +1,288 @@
+"""In-process load test for the purchase path; run it on a throwaway database."""
+import itertools
+import logging
+import random
+import threading
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.db import connection, OperationalError
+from django.db.models import Count, DecimalField, F, Sum
+from django.test import Client
+from django.urls import reverse
+
+from . import outbox, purchases
+from .models import UserProfile, Product, OrderHeader, Order
+
+PERCENTILES = (50, 95, 99)
+
+
+def is_lock_error(error):
+	message = str(error).lower()
+	return 'locked' in message or 'busy' in message
+
+
+def percentile(sorted_values, pct):
+	# Nearest-rank percentile of an already sorted list
+	if not sorted_values:
+		return None
+	rank = max(1, -(-len(sorted_values) * pct // 100))
+	return sorted_values[rank - 1]
+
+
+def seed(buyers, farmers, products, stock, prefix='loadtest'):
+	"""Create the users and products a run needs. Returns (buyers, farmers, products)."""
+	def create_users(role, count):
+		users = User.objects.bulk_create([
+			User(username=f'{prefix}_{role.lower()}_{i}') for i in range(count)
+		])
+		UserProfile.objects.bulk_create([UserProfile(user=user, role=role) for user in users])
+		return list(User.objects.filter(username__startswith=f'{prefix}_{role.lower()}_').select_related('userprofile'))
+
+	buyer_users = create_users('Buyer', buyers)
+	farmer_users = create_users('Farmer', farmers)
+	# Created one at a time so the search index and facet signals fire as in production
+	catalog = [
+		Product.objects.create(
+			name=f'Load test product {i}',
+			category=Product.CATEGORY_CHOICES[i % len(Product.CATEGORY_CHOICES)][0],
+			price=5 + i,
+			quantity=stock,
+			farmer=farmer_users[i % len(farmer_users)],
+		)
+		for i in range(products)
+	]
+	# One order per product up front, so farmer threads have work from the start
+	for buyer, product in zip(itertools.cycle(buyer_users), catalog):
+		purchases.place_orders(buyer, [(product, 1)])
+	return buyer_users, farmer_users, catalog
+
+
+class Recorder:
+	"""Thread-safe latency and error tally per endpoint."""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.latencies = {}
+		self.statuses = {}
+		self.errors = {}
+		self.lock_errors = {}
+
+	def record(self, endpoint, elapsed, status):
+		with self.lock:
+			self.latencies.setdefault(endpoint, []).append(elapsed)
+			counts = self.statuses.setdefault(endpoint, {})
+			counts[status] = counts.get(status, 0) + 1
+
+	def error(self, endpoint, lock_error):
+		with self.lock:
+			tally = self.lock_errors if lock_error else self.errors
+			tally[endpoint] = tally.get(endpoint, 0) + 1
+
+	def summary(self, duration):
+		endpoints = {}
+		everything = []
+		for endpoint, latencies in sorted(self.latencies.items()):
+			latencies = sorted(latencies)
+			everything.extend(latencies)
+			endpoints[endpoint] = {
+				'requests': len(latencies),
+				'rps': round(len(latencies) / duration, 2) if duration else None,
+				'statuses': {str(status): count for status, count in sorted(self.statuses[endpoint].items(), key=lambda item: str(item[0]))},
+				'errors': self.errors.get(endpoint, 0),
+				'lock_errors': self.lock_errors.get(endpoint, 0),
+				**latency_stats(latencies),
+			}
+		everything.sort()
+		return {
+			'requests': len(everything),
+			'rps': round(len(everything) / duration, 2) if duration else None,
+			'errors': sum(self.errors.values()),
+			'lock_errors': sum(self.lock_errors.values()),
+			**latency_stats(everything),
+		}, endpoints
+
+
+def latency_stats(sorted_latencies):
+	stats = {f'p{pct}_ms': round(percentile(sorted_latencies, pct) * 1000, 2) if sorted_latencies else None for pct in PERCENTILES}
+	stats['max_ms'] = round(sorted_latencies[-1] * 1000, 2) if sorted_latencies else None
+	return stats
+
+
+class Worker(threading.Thread):
+	def __init__(self, user, iterations, barrier, recorder, rng):
+		super().__init__(daemon=True)
+		self.user = user
+		self.iterations = iterations
+		self.barrier = barrier
+		self.recorder = recorder
+		self.rng = rng
+		self.lock_error = False
+		self.client = Client()
+		self.client.force_login(user)
+
+	def watch_locks(self, execute, sql, params, many, context):
+		# Notice lock/busy errors at the database layer, including ones a
+		# view catches and turns into an error response
+		try:
+			return execute(sql, params, many, context)
+		except OperationalError as e:
+			if is_lock_error(e):
+				self.lock_error = True
+			raise
+
+	def request(self, endpoint, method, path, data=None):
+		self.lock_error = False
+		headers = {'HTTP_IDEMPOTENCY_KEY': uuid.uuid4().hex} if method == 'post' else {}
+		started = time.perf_counter()
+		try:
+			status = getattr(self.client, method)(path, data or {}, **headers).status_code
+		except Exception as e:
+			# COMMIT failures never pass through the execute wrapper
+			if isinstance(e, OperationalError) and is_lock_error(e):
+				self.lock_error = True
+			status = 'exception'
+		elapsed = time.perf_counter() - started
+		if self.lock_error:
+			self.recorder.error(endpoint, lock_error=True)
+		elif status == 'exception' or status >= 500:
+			self.recorder.error(endpoint, lock_error=False)
+		self.recorder.record(endpoint, elapsed, status)
+
+	def run(self):
+		try:
+			self.barrier.wait()
+			with connection.execute_wrapper(self.watch_locks):
+				for _ in range(self.iterations):
+					self.step()
+		finally:
+			connection.close()
+
+	def step(self):
+		raise NotImplementedError
+
+
+class BuyerWorker(Worker):
+	def __init__(self, *args, products, max_quantity, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.products = products
+		self.max_quantity = max_quantity
+
+	def step(self):
+		self.request('buyer_dashboard', 'get', reverse('buyer_dashboard'))
+		product = self.rng.choice(self.products)
+		self.request('add_to_cart', 'post', reverse('add_to_cart', args=[product.id]), {
+			'quantity': self.rng.randint(1, self.max_quantity),
+		})
+		self.request('checkout', 'post', reverse('checkout'))
+
+
+class FarmerWorker(Worker):
+	def step(self):
+		try:
+			order_ids = list(
+				Order.objects.filter(product__farmer=self.user).order_by('-id').values_list('id', flat=True)[:50]
+			)
+		except OperationalError:
+			return
+		if not order_ids:
+			time.sleep(0.01)
+			return
+		self.request('update_order_status', 'post', reverse('update_order_status', args=[self.rng.choice(order_ids)]), {
+			'status': self.rng.choice(Order.STATUS_CHOICES)[0],
+		})
+
+
+def check_consistency(products, stock):
+	"""Return a list of problems: stock created or lost, or headers that disagree with their lines."""
+	violations = []
+	sold = dict(
+		Order.objects.filter(product__in=products).values_list('product_id').annotate(units=Sum('quantity')).order_by()
+	)
+	for product_id, quantity in Product.objects.filter(pk__in=[product.pk for product in products]).values_list('id', 'quantity'):
+		units = sold.get(product_id, 0)
+		if quantity + units != stock:
+			violations.append({
+				'type': 'stock',
+				'product_id': product_id,
+				'remaining': quantity,
+				'sold': units,
+				'initial': stock,
+			})
+	headers = (
+		OrderHeader.objects.filter(lines__product__in=products).distinct()
+		.annotate(
+			lines_count=Count('lines'),
+			lines_total=Sum(F('lines__quantity') * F('lines__unit_price'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+		)
+		.values_list('id', 'line_count', 'total_amount', 'lines_count', 'lines_total')
+	)
+	for header_id, line_count, total_amount, lines_count, lines_total in headers:
+		if line_count != lines_count or total_amount != lines_total:
+			violations.append({
+				'type': 'order_header',
+				'order_header_id': header_id,
+				'line_count': line_count,
+				'lines': lines_count,
+				'total_amount': str(total_amount),
+				'lines_total': str(lines_total),
+			})
+	return violations
+
+
+def run(buyers=32, farmers=4, products=8, stock=100, iterations=20, max_quantity=5, seed_value=None):
+	"""Seed the database, run the load and return the results as a dict."""
+	rng = random.Random(seed_value)
+	buyer_users, farmer_users, catalog = seed(buyers, farmers, products, stock)
+	connection.close()
+
+	recorder = Recorder()
+	barrier = threading.Barrier(buyers + farmers + 1)
+	workers = [
+		BuyerWorker(user, iterations, barrier, recorder, random.Random(rng.random()), products=catalog, max_quantity=max_quantity)
+		for user in buyer_users
+	] + [
+		FarmerWorker(user, iterations, barrier, recorder, random.Random(rng.random()))
+		for user in farmer_users
+	]
+	# Failed requests are counted in the results; don't also log each one
+	request_logger = logging.getLogger('django.request')
+	request_logger.disabled = True
+	try:
+		for worker in workers:
+			worker.start()
+		barrier.wait()
+		started = time.perf_counter()
+		for worker in workers:
+			worker.join()
+		duration = time.perf_counter() - started
+	finally:
+		request_logger.disabled = False
+
+	overall, endpoints = recorder.summary(duration)
+	violations = check_consistency(catalog, stock)
+	orders = Order.objects.filter(product__in=catalog)
+	return {
+		'config': {
+			'buyers': buyers,
+			'farmers': farmers,
+			'products': products,
+			'stock': stock,
+			'iterations': iterations,
+			'max_quantity': max_quantity,
+			'seed': seed_value,
+			'database_vendor': connection.vendor,
+		},
+		'duration_s': round(duration, 3),
+		'overall': overall,
+		'endpoints': endpoints,
+		'orders': {
+			'headers': OrderHeader.objects.filter(buyer__in=buyer_users).count(),
+			'lines': orders.count(),
+			'units': orders.aggregate(units=Sum('quantity'))['units'] or 0,
+		},
+		# Notifications are delivered later by dispatch_outbox; this is what the run left queued
+		'outbox': outbox.stats(),
+		'consistency_violations': violations,
+	}
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from marketplace import storage as content_storage, thumbnails
+from marketplace.models import Product, StoredFile
+
+class Command(BaseCommand):
+	help = 'Move product photos into content-addressed storage, keeping one copy of identical files'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--dry-run', action='store_true', help='Only report how many files would be merged')
+		parser.add_argument('--keep-originals', action='store_true', help='Leave the old files in place after moving them')
+		parser.add_argument('--delete-orphans', action='store_true', help='Also remove old photos no product refers to')
+
+	def handle(self, *args, **options):
+		storage = Product._meta.get_field('image').storage
+		legacy = list(
+			Product.objects.exclude(image__isnull=True).exclude(image='')
+			.exclude(image__in=StoredFile.objects.values('name'))
+			.order_by('image').values_list('image', flat=True).distinct()
+		)
+		missing = [name for name in legacy if not storage.exists(name)]
+		for name in missing:
+			self.stderr.write(f'Missing file, left as is: {name}')
+		legacy = [name for name in legacy if name not in missing]
+
+		if options['dry_run']:
+			sizes = {}
+			for name in legacy:
+				sizes[content_storage.file_digest(storage, name)] = storage.size(name)
+			self.stdout.write(
+				f'{len(legacy)} file(s) ({sum(storage.size(name) for name in legacy)} bytes) '
+				f'would be stored as {len(sizes)} file(s) ({sum(sizes.values())} bytes).'
+			)
+			return
+
+		before = stored = 0
+		new_names = set()
+		for name in legacy:
+			before += storage.size(name)
+			with transaction.atomic():
+				products = Product.objects.select_for_update().filter(image=name)
+				new_name = storage.adopt(name, products.count())
+				variants = products.filter(image_variants_source=name).values_list('image_variants', flat=True).first()
+				if variants:
+					# Copy now, delete the old ones only once the products point elsewhere
+					thumbnails.copy_variants(name, new_name, variants)
+					products.filter(image_variants_source=name).update(image_variants_source=new_name)
+				products.update(image=new_name, card_version=F('card_version') + 1)
+			if new_name not in new_names:
+				new_names.add(new_name)
+				stored += storage.size(new_name)
+			if variants:
+				thumbnails.delete_variants(name, variants)
+			if not options['keep_originals']:
+				storage.delete_untracked(name)
+			self.stdout.write(f'{name} -> {new_name}')
+
+		orphans = []
+		upload_dir = Product._meta.get_field('image').upload_to.rstrip('/')
+		if storage.exists(upload_dir):
+			referenced = set(Product.objects.filter(image__startswith=upload_dir).values_list('image', flat=True))
+			orphans = [
+				f'{upload_dir}/{filename}' for filename in storage.listdir(upload_dir)[1]
+				if f'{upload_dir}/{filename}' not in referenced
+			]
+		if orphans and options['delete_orphans']:
+			for name in orphans:
+				storage.delete_untracked(name)
+			self.stdout.write(f'Removed {len(orphans)} photo(s) no product refers to.')
+		elif orphans:
+			self.stdout.write(f'{len(orphans)} photo(s) no product refers to; remove them with --delete-orphans.')
+
+		self.stdout.write(self.style.SUCCESS(
+			f'Moved {len(legacy)} file(s) ({before} bytes) into {len(new_names)} stored file(s) ({stored} bytes).'
+		))
@@ -0,0 +1,57 @@
+import json
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections
+from marketplace import outbox
+
+class Command(BaseCommand):
+	help = 'Deliver pending outbox events as notifications, once or continuously with --loop'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE)
+		parser.add_argument('--loop', action='store_true', help='Keep polling for new events instead of exiting once drained')
+		parser.add_argument('--interval', type=float, default=1.0, help='Seconds to wait when the outbox is empty (with --loop)')
+		parser.add_argument('--purge-days', type=int, default=7, help='Delete delivered events older than this many days; 0 keeps them')
+		parser.add_argument('--stats', action='store_true', help='Print backlog and drain metrics as JSON and exit')
+
+	def handle(self, *args, **options):
+		if options['stats']:
+			self.stdout.write(json.dumps(outbox.stats()))
+			return
+
+		if options['purge_days']:
+			removed = outbox.purge_processed(timedelta(days=options['purge_days']))
+			if removed:
+				self.stdout.write(f'Purged {removed} delivered event(s).')
+
+		started = time.monotonic()
+		events = notifications = 0
+		try:
+			while True:
+				try:
+					handled, created = outbox.dispatch(options['batch_size'])
+				except OperationalError as e:
+					# Busy database; the batch is still pending, try again shortly
+					self.stderr.write(f'Dispatch failed, retrying: {e}')
+					handled, created = 0, 0
+				events += handled
+				notifications += created
+				if handled:
+					elapsed = time.monotonic() - started
+					self.stdout.write(
+						f'Delivered {handled} event(s) as {created} notification(s); '
+						f'{events / elapsed:.1f} events/s, backlog {outbox.pending().count()}.'
+					)
+					continue
+				if not options['loop']:
+					break
+				close_old_connections()
+				time.sleep(options['interval'])
+		except KeyboardInterrupt:
+			pass
+
+		self.stdout.write(self.style.SUCCESS(
+			f'Dispatched {events} event(s) into {notifications} notification(s) in {time.monotonic() - started:.1f}s.'
+		))
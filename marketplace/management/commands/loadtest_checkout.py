@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+from marketplace import loadtest
+
+class Command(BaseCommand):
+	help = 'Load-test add_to_cart, checkout, buyer_dashboard and update_order_status from many threads on a throwaway database'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--buyers', type=int, default=32, help='Concurrent buyer threads')
+		parser.add_argument('--farmers', type=int, default=4, help='Concurrent farmer threads')
+		parser.add_argument('--products', type=int, default=8)
+		parser.add_argument('--stock', type=int, default=100, help='Initial quantity of every product')
+		parser.add_argument('--iterations', type=int, default=20, help='Rounds per thread')
+		parser.add_argument('--max-quantity', type=int, default=5, help='Largest quantity added to the cart at once')
+		parser.add_argument('--seed', type=int, help='Random seed, for repeatable runs')
+		parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+
+	def handle(self, *args, **options):
+		# A file-backed test database, so threads contend for the same locks
+		# as separate requests would; SQLite's shared in-memory database
+		# locks whole tables instead
+		test_name = None
+		if connection.vendor == 'sqlite':
+			test_name = os.path.join(tempfile.mkdtemp(prefix='loadtest-'), 'db.sqlite3')
+			connection.settings_dict['TEST']['NAME'] = test_name
+
+		setup_test_environment()
+		runner = DiscoverRunner(verbosity=0, interactive=False)
+		old_config = runner.setup_databases()
+		try:
+			results = loadtest.run(
+				buyers=options['buyers'],
+				farmers=options['farmers'],
+				products=options['products'],
+				stock=options['stock'],
+				iterations=options['iterations'],
+				max_quantity=options['max_quantity'],
+				seed_value=options['seed'],
+			)
+		finally:
+			runner.teardown_databases(old_config)
+			teardown_test_environment()
+			if test_name:
+				os.rmdir(os.path.dirname(test_name))
+
+		output = json.dumps(results, indent=2)
+		if options['output']:
+			with open(options['output'], 'w') as f:
+				f.write(output + '\n')
+		else:
+			self.stdout.write(output)
+
+		overall = results['overall']
+		summary = (
+			f"{overall['requests']} requests at {overall['rps']} req/s, "
+			f"p95 {overall['p95_ms']} ms, {overall['lock_errors']} lock error(s), "
+			f"{len(results['consistency_violations'])} consistency violation(s)."
+		)
+		if results['consistency_violations']:
+			self.stderr.write(self.style.ERROR(summary))
+		else:
+			self.stderr.write(self.style.SUCCESS(summary))
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from marketplace import thumbnails
+from marketplace.models import Product
+
+class Command(BaseCommand):
+	help = 'Render responsive WebP/JPEG variants of product photos, once or continuously with --loop'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: one per CPU)')
+		parser.add_argument('--batch-size', type=int, default=50)
+		parser.add_argument('--loop', action='store_true', help='Keep polling for new uploads instead of exiting once done')
+		parser.add_argument('--interval', type=float, default=5.0, help='Seconds to wait when nothing is pending (with --loop)')
+		parser.add_argument('--force', action='store_true', help='Re-render every product image, not only new or changed ones')
+
+	def handle(self, *args, **options):
+		if options['force']:
+			Product.objects.exclude(image_variants_source='').update(image_variants_source='')
+
+		started = time.monotonic()
+		done = failed = 0
+		try:
+			while True:
+				batch = list(thumbnails.pending().order_by('id').values_list('id', 'image')[:options['batch_size']])
+				if batch:
+					batch_done, batch_failed = thumbnails.process(batch, options['workers'])
+					done += batch_done
+					failed += batch_failed
+					self.stdout.write(f'Processed {len(batch)} image(s): {batch_done} done, {batch_failed} failed.')
+					continue
+				if not options['loop']:
+					break
+				close_old_connections()
+				time.sleep(options['interval'])
+		except KeyboardInterrupt:
+			pass
+
+		self.stdout.write(self.style.SUCCESS(
+			f'Made variants for {done} image(s), {failed} failed, in {time.monotonic() - started:.1f}s.'
+		))
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from marketplace import inbox
+
+class Command(BaseCommand):
+	help = 'Delete, or archive with --archive, read notifications older than --days in batches'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--days', type=int, default=inbox.READ_RETENTION.days, help='Keep read notifications newer than this')
+		parser.add_argument('--batch-size', type=int, default=1000)
+		parser.add_argument('--archive', action='store_true', help='Move them to ArchivedNotification instead of deleting')
+
+	def handle(self, *args, **options):
+		removed = inbox.purge_read(timedelta(days=options['days']), options['batch_size'], options['archive'])
+		verb = 'Archived' if options['archive'] else 'Deleted'
+		self.stdout.write(self.style.SUCCESS(f'{verb} {removed} read notification(s).'))
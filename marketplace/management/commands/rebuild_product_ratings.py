@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from marketplace.models import Product, Review
+
+class Command(BaseCommand):
+	help = 'Rebuild the denormalized rating count, sum and average on Product from Review'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=1000)
+
+	def handle(self, *args, **options):
+		batch_size = options['batch_size']
+		stats = {
+			row['product_id']: (row['count'], row['total'])
+			for row in Review.objects.values('product_id').annotate(count=Count('id'), total=Sum('rating'))
+		}
+
+		updated = 0
+		batch = []
+		with transaction.atomic():
+			for product in Product.objects.only('id', 'rating_count', 'rating_sum', 'rating_avg').iterator(chunk_size=batch_size):
+				count, total = stats.get(product.id, (0, 0))
+				avg = total / count if count else 0
+				if (product.rating_count, product.rating_sum, product.rating_avg) == (count, total, avg):
+					continue
+				product.rating_count = count
+				product.rating_sum = total
+				product.rating_avg = avg
+				# A new version makes cached product cards re-render with the rating
+				product.card_version = F('card_version') + 1
+				batch.append(product)
+				if len(batch) >= batch_size:
+					Product.objects.bulk_update(batch, ['rating_count', 'rating_sum', 'rating_avg', 'card_version'])
+					updated += len(batch)
+					batch = []
+			if batch:
+				Product.objects.bulk_update(batch, ['rating_count', 'rating_sum', 'rating_avg', 'card_version'])
+				updated += len(batch)
+
+		self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates for {updated} product(s).'))
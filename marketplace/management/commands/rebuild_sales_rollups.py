@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from marketplace.models import Order, SalesRollup
+
+class Command(BaseCommand):
+	help = 'Rebuild the daily SalesRollup table from Order'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=1000)
+		parser.add_argument('--farmer', type=int, help='Only rebuild rollups for this farmer id')
+
+	def handle(self, *args, **options):
+		batch_size = options['batch_size']
+		orders = Order.objects.all()
+		rollups = SalesRollup.objects.all()
+		if options['farmer']:
+			orders = orders.filter(product__farmer_id=options['farmer'])
+			rollups = rollups.filter(farmer_id=options['farmer'])
+
+		rows = (
+			orders.annotate(day=TruncDate('order_date', tzinfo=timezone.get_current_timezone()))
+			.values('product__farmer_id', 'product_id', 'product__category', 'day')
+			.annotate(
+				units=Sum('quantity'),
+				revenue=Sum(F('quantity') * F('unit_price'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+			)
+			.order_by()
+		)
+
+		created = 0
+		with transaction.atomic():
+			rollups.delete()
+			batch = []
+			for row in rows.iterator(chunk_size=batch_size):
+				batch.append(SalesRollup(
+					farmer_id=row['product__farmer_id'],
+					product_id=row['product_id'],
+					category=row['product__category'],
+					day=row['day'],
+					units_sold=row['units'],
+					revenue=row['revenue'],
+				))
+				if len(batch) >= batch_size:
+					SalesRollup.objects.bulk_create(batch)
+					created += len(batch)
+					batch = []
+			if batch:
+				SalesRollup.objects.bulk_create(batch)
+				created += len(batch)
+
+		self.stdout.write(self.style.SUCCESS(f'Wrote {created} rollup row(s).'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from marketplace import search
+
+class Command(BaseCommand):
+	help = 'Rebuild the SQLite FTS5 product search index from Product'
+
+	def handle(self, *args, **options):
+		if not search.is_enabled():
+			self.stdout.write(self.style.WARNING('Full-text search needs SQLite; nothing to rebuild.'))
+			return
+		with transaction.atomic():
+			count = search.rebuild_index()
+		self.stdout.write(self.style.SUCCESS(f'Indexed {count} product(s).'))
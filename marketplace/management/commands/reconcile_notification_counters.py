@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from marketplace import inbox
+
+class Command(BaseCommand):
+	help = 'Check the per-user unread notification counters against Notification and correct any that drifted'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=1000)
+		parser.add_argument('--dry-run', action='store_true', help='Only report how many counters are wrong')
+
+	def handle(self, *args, **options):
+		wrong = inbox.reconcile(fix=not options['dry_run'], batch_size=options['batch_size'])
+		if options['dry_run']:
+			self.stdout.write(f'{wrong} counter(s) out of step.')
+		else:
+			self.stdout.write(self.style.SUCCESS(f'Corrected {wrong} counter(s).'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from marketplace import inventory
+
+class Command(BaseCommand):
+	help = 'Delete expired cart stock holds in batches'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=1000)
+
+	def handle(self, *args, **options):
+		removed = inventory.sweep_expired(options['batch_size'])
+		self.stdout.write(self.style.SUCCESS(f'Removed {removed} expired hold(s).'))
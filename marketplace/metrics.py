@@ -0,0 +1,198 @@
+"""Per-view request metrics, exposed in the Prometheus text format.
+
+Histograms are kept per process and reset when it restarts.
+"""
+import contextvars
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+# Seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+# Bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+UNMATCHED = 'unmatched'
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestStats:
+	"""What one request cost; available to tests as request.metrics."""
+
+	def __init__(self):
+		self.view = UNMATCHED
+		self.queries = 0
+		self.query_seconds = 0.0
+		self.started = time.perf_counter()
+
+
+class Histogram:
+	def __init__(self, buckets):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum = 0
+		self.count = 0
+
+	def observe(self, value):
+		index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+		self.counts[index] += 1
+		self.sum += value
+		self.count += 1
+
+	def cumulative(self):
+		total = 0
+		for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+			total += count
+			yield bound, total
+
+
+class Registry:
+	"""Request counters and per-view histograms, safe to update from any thread."""
+
+	HISTOGRAMS = {
+		'request_duration_seconds': ('Request latency by view.', DURATION_BUCKETS),
+		'db_queries': ('Database queries per request by view.', QUERY_COUNT_BUCKETS),
+		'db_query_duration_seconds': ('Time spent in database queries per request by view.', DURATION_BUCKETS),
+		'response_size_bytes': ('Response body size by view.', SIZE_BUCKETS),
+	}
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		with self.lock:
+			self.requests = {}
+			self.histograms = {name: {} for name in self.HISTOGRAMS}
+
+	def _observe(self, name, view, value):
+		histograms = self.histograms[name]
+		if view not in histograms:
+			histograms[view] = Histogram(self.HISTOGRAMS[name][1])
+		histograms[view].observe(value)
+
+	def record(self, stats, method, status, size):
+		duration = time.perf_counter() - stats.started
+		with self.lock:
+			key = (stats.view, method, str(status))
+			self.requests[key] = self.requests.get(key, 0) + 1
+			self._observe('request_duration_seconds', stats.view, duration)
+			self._observe('db_queries', stats.view, stats.queries)
+			self._observe('db_query_duration_seconds', stats.view, stats.query_seconds)
+			if size is not None:
+				self._observe('response_size_bytes', stats.view, size)
+
+	def render(self, gauges=None):
+		"""Prometheus text exposition of everything recorded, plus {name: (help, value)} gauges."""
+		lines = [
+			'# HELP marketplace_requests_total Requests by view, method and status.',
+			'# TYPE marketplace_requests_total counter',
+		]
+		with self.lock:
+			for (view, method, status), count in sorted(self.requests.items()):
+				lines.append(f'marketplace_requests_total{_labels(view=view, method=method, status=status)} {count}')
+			for name, (help_text, _) in self.HISTOGRAMS.items():
+				metric = f'marketplace_{name}'
+				lines.append(f'# HELP {metric} {help_text}')
+				lines.append(f'# TYPE {metric} histogram')
+				for view, histogram in sorted(self.histograms[name].items()):
+					for bound, total in histogram.cumulative():
+						lines.append(f'{metric}_bucket{_labels(view=view, le=bound)} {total}')
+					lines.append(f'{metric}_sum{_labels(view=view)} {_number(histogram.sum)}')
+					lines.append(f'{metric}_count{_labels(view=view)} {histogram.count}')
+		for name, (help_text, value) in (gauges or {}).items():
+			lines.append(f'# HELP marketplace_{name} {help_text}')
+			lines.append(f'# TYPE marketplace_{name} gauge')
+			lines.append(f'marketplace_{name} {_number(value)}')
+		return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+	return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _number(value):
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+
+def record_query(execute, sql, params, many, context):
+	"""Execute wrapper: count and time the query against the current request, if any."""
+	stats = _current.get()
+	if stats is None:
+		return execute(sql, params, many, context)
+	started = time.perf_counter()
+	try:
+		return execute(sql, params, many, context)
+	finally:
+		stats.queries += 1
+		stats.query_seconds += time.perf_counter() - started
+
+
+def instrument(connection):
+	if record_query not in connection.execute_wrappers:
+		connection.execute_wrappers.append(record_query)
+
+
+def _response_size(response):
+	if not response.streaming:
+		return len(response.content)
+	length = response.get('Content-Length')
+	return int(length) if length and length.isdigit() else None
+
+
+class MetricsMiddleware:
+	"""Record latency, query count and time, and response size per URL name.
+
+	Goes first in MIDDLEWARE so the timing covers the rest of the stack.
+	Works in both sync and async mode, so async views stay async under ASGI.
+	For streaming responses the latency runs up to the first byte, not to
+	the end of the stream.
+	"""
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+		if iscoroutinefunction(get_response):
+			markcoroutinefunction(self)
+
+	def _start(self, request):
+		stats = request.metrics = RequestStats()
+		return stats, _current.set(stats)
+
+	def _finish(self, request, response, stats, token):
+		_current.reset(token)
+		if request.resolver_match is not None:
+			stats.view = request.resolver_match.view_name
+		registry.record(stats, request.method, response.status_code, _response_size(response))
+		return response
+
+	def __call__(self, request):
+		if iscoroutinefunction(self):
+			return self.__acall__(request)
+		stats, token = self._start(request)
+		try:
+			response = self.get_response(request)
+		except BaseException:
+			_current.reset(token)
+			raise
+		return self._finish(request, response, stats, token)
+
+	async def __acall__(self, request):
+		stats, token = self._start(request)
+		try:
+			response = await self.get_response(request)
+		except BaseException:
+			_current.reset(token)
+			raise
+		return self._finish(request, response, stats, token)
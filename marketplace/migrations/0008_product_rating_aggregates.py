@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:50
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Product = apps.get_model('marketplace', 'Product')
+    Review = apps.get_model('marketplace', 'Review')
+    stats = Review.objects.values('product_id').annotate(count=Count('id'), total=Sum('rating'))
+    for row in stats.iterator():
+        Product.objects.filter(pk=row['product_id']).update(
+            rating_count=row['count'],
+            rating_sum=row['total'],
+            rating_avg=row['total'] / row['count'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0007_cart'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
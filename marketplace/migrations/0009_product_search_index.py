@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from marketplace import search
+    connection = schema_editor.connection
+    if not search.is_enabled(connection):
+        return
+    search.rebuild_index(connection)
+
+
+def drop_search_index(apps, schema_editor):
+    from marketplace import search
+    connection = schema_editor.connection
+    if not search.is_enabled(connection):
+        return
+    with connection.cursor() as cursor:
+        for sql in search.DROP_SQL:
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0008_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
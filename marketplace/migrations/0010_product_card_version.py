@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0009_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='card_version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0010_product_card_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('Vegetables - Leafy', 'Vegetables - Leafy'), ('Vegetables - Root', 'Vegetables - Root'), ('Vegetables - Marrow', 'Vegetables - Marrow'), ('Fruits - Seasonal', 'Fruits - Seasonal'), ('Fruits - Tropical', 'Fruits - Tropical'), ('Fruits - Berries', 'Fruits - Berries'), ('Grains & Cereals - Rice', 'Grains & Cereals - Rice'), ('Grains & Cereals - Wheat', 'Grains & Cereals - Wheat'), ('Grains & Cereals - Corn', 'Grains & Cereals - Corn'), ('Pulses & Legumes - Lentils', 'Pulses & Legumes - Lentils'), ('Pulses & Legumes - Beans', 'Pulses & Legumes - Beans'), ('Pulses & Legumes - Peas', 'Pulses & Legumes - Peas'), ('Dairy Products - Milk', 'Dairy Products - Milk'), ('Dairy Products - Butter', 'Dairy Products - Butter'), ('Dairy Products - Cheese', 'Dairy Products - Cheese'), ('Livestock - Poultry', 'Livestock - Poultry'), ('Livestock - Cattle', 'Livestock - Cattle'), ('Livestock - Sheep', 'Livestock - Sheep'), ('Spices & Herbs', 'Spices & Herbs')], max_length=50)),
+                ('day', models.DateField()),
+                ('units_sold', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('farmer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to=settings.AUTH_USER_MODEL)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='marketplace.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['farmer', 'day'], name='marketplace_farmer__b1348f_idx')],
+                'unique_together': {('farmer', 'product', 'category', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,85 @@
+import django.db.models.deletion
+from datetime import timedelta
+from django.conf import settings
+from django.db import migrations, models
+
+# Old checkouts wrote one Order per cart line a few milliseconds apart; a
+# buyer's orders placed within this window are grouped under one header.
+GROUP_WINDOW = timedelta(seconds=5)
+
+
+def group_orders_into_headers(apps, schema_editor):
+    Order = apps.get_model('marketplace', 'Order')
+    OrderHeader = apps.get_model('marketplace', 'OrderHeader')
+    Notification = apps.get_model('marketplace', 'Notification')
+
+    def flush(group):
+        header = OrderHeader.objects.create(
+            buyer_id=group[0].buyer_id,
+            line_count=len(group),
+            total_amount=sum(order.unit_price * order.quantity for order in group),
+        )
+        OrderHeader.objects.filter(pk=header.pk).update(created_date=group[0].order_date)
+        ids = [order.id for order in group]
+        Order.objects.filter(id__in=ids).update(header=header)
+        Notification.objects.filter(order_id__in=ids).update(order_header=header)
+
+    group = []
+    orders = Order.objects.select_related('product').order_by('buyer_id', 'order_date', 'id')
+    for order in orders.iterator(chunk_size=2000):
+        # The live price is the best snapshot available for historical orders
+        order.unit_price = order.product.price
+        Order.objects.filter(pk=order.pk).update(unit_price=order.unit_price)
+        if group and (order.buyer_id != group[0].buyer_id or order.order_date - group[0].order_date > GROUP_WINDOW):
+            flush(group)
+            group = []
+        group.append(order)
+    if group:
+        flush(group)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0013_idempotencykey'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderHeader',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('line_count', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('buyer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_headers', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='header',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='marketplace.orderheader'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='order_header',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='marketplace.orderheader'),
+        ),
+        migrations.RunPython(group_orders_into_headers, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='header',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='marketplace.orderheader'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+    ]
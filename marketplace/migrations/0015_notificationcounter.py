@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_notification_counters(apps, schema_editor):
+    Notification = apps.get_model('marketplace', 'Notification')
+    NotificationCounter = apps.get_model('marketplace', 'NotificationCounter')
+    unread = Notification.objects.filter(is_read=False).values('user_id').annotate(count=Count('id')).order_by()
+    NotificationCounter.objects.bulk_create(
+        [NotificationCounter(user_id=row['user_id'], unread=row['count']) for row in unread.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('marketplace', '0014_orderheader'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='notification_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_notification_counters, migrations.RunPython.noop),
+    ]
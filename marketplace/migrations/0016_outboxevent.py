@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0015_notificationcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='dedup_key',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('order_placed', 'Order placed'), ('direct_purchase', 'Direct purchase'), ('order_status', 'Order status changed')], max_length=30)),
+                ('payload', models.JSONField(default=dict)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('processed_date', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed_date', 'id'], name='marketplace_process_598ba2_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0017_notification_inbox_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_variants_source',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0019_stored_files'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['buyer', 'product'], name='marketplace_buyer_i_3931c9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderheader',
+            index=models.Index(fields=['buyer', 'created_date'], name='marketplace_buyer_i_47ef69_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price'], name='marketplace_categor_89016c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price'], name='marketplace_price_34d50e_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0020_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchEntry',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='marketplace.product')),
+                ('name', models.TextField()),
+                ('category', models.TextField()),
+            ],
+            options={
+                'db_table': 'marketplace_product_fts',
+                'managed': False,
+            },
+        ),
+    ]
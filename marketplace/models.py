@@ -1,7 +1,10 @@
 
 from django.db import models
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.files.storage import storages
 
 class UserProfile(models.Model):
 	ROLE_CHOICES = [
@@ -19,6 +22,10 @@ def validate_farmer(user):
 	if not hasattr(user, 'userprofile') or user.userprofile.role != 'Farmer':
 		raise ValidationError('User must have Farmer role to be linked to a Product.')
 
+def product_image_storage():
+	# Content-addressed storage from settings.STORAGES; see storage.py
+	return storages['product_images']
+
 class Product(models.Model):
 	CATEGORY_CHOICES = [
 		('Vegetables - Leafy', 'Vegetables - Leafy'),
@@ -46,31 +53,111 @@ class Product(models.Model):
 	category = models.CharField(max_length=50, choices=CATEGORY_CHOICES)
 	price = models.DecimalField(max_digits=10, decimal_places=2)
 	quantity = models.PositiveIntegerField()
-	image = models.ImageField(upload_to='product_images/', blank=True, null=True)
+	image = models.ImageField(upload_to='product_images/', storage=product_image_storage, blank=True, null=True)
 	farmer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='products', validators=[validate_farmer])
+	# Denormalized review aggregates, maintained by record_rating() and
+	# rebuilt from Review by the rebuild_product_ratings command
+	rating_count = models.PositiveIntegerField(default=0)
+	rating_sum = models.PositiveIntegerField(default=0)
+	rating_avg = models.FloatField(default=0)
+	# Bumped whenever anything shown on a product card changes; part of the
+	# card fragment cache key so stale cards are never served
+	card_version = models.PositiveIntegerField(default=1)
+	# Widths of the resized copies of image made by thumbnails.py, per format;
+	# they belong to image only while image_variants_source equals image.name
+	image_variants = models.JSONField(default=dict, blank=True)
+	image_variants_source = models.CharField(max_length=100, blank=True)
+
+	class Meta:
+		indexes = [
+			# Category filter with price sort, and category facet counts
+			models.Index(fields=['category', 'price']),
+			# Price sort and price facet buckets over the whole catalog
+			models.Index(fields=['price']),
+		]
 
 	def save(self, *args, **kwargs):
 		validate_farmer(self.farmer)
+		bump = self.pk is not None and not self._state.adding
+		if bump:
+			self.card_version = F('card_version') + 1
+			if kwargs.get('update_fields') is not None:
+				kwargs['update_fields'] = {*kwargs['update_fields'], 'card_version'}
 		super().save(*args, **kwargs)
+		if bump:
+			self.refresh_from_db(fields=['card_version'])
+
+	@property
+	def average_rating(self):
+		return round(self.rating_avg, 1) if self.rating_count else 0
+
+	def record_rating(self, rating, previous_rating=None):
+		# Fold a new (previous_rating is None) or changed review into the
+		# stored aggregates
+		count_delta = 0 if previous_rating is not None else 1
+		Product.adjust_ratings(self.pk, count_delta, rating - (previous_rating or 0))
+		self.refresh_from_db(fields=['rating_count', 'rating_sum', 'rating_avg', 'card_version'])
+
+	@staticmethod
+	def adjust_ratings(product_id, count_delta, sum_delta):
+		# Apply a change in review count and star total with a single UPDATE;
+		# the average goes back to 0 when the last review is removed
+		Product.objects.filter(pk=product_id).update(
+			rating_count=F('rating_count') + count_delta,
+			rating_sum=F('rating_sum') + sum_delta,
+			rating_avg=Case(
+				When(rating_count=-count_delta, then=Value(0.0)),
+				default=Cast(F('rating_sum') + sum_delta, FloatField()) / (F('rating_count') + count_delta),
+			),
+			card_version=F('card_version') + 1,
+		)
 
 	def __str__(self):
 		return self.name
 
+class OrderHeader(models.Model):
+	# One checkout or direct purchase; its Order rows are the line items
+	buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='order_headers')
+	created_date = models.DateTimeField(auto_now_add=True)
+	line_count = models.PositiveIntegerField(default=0)
+	total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+	class Meta:
+		indexes = [
+			# Buyer order history, newest first
+			models.Index(fields=['buyer', 'created_date']),
+		]
+
+	def __str__(self):
+		return f"Order #{self.id} by {self.buyer.username}"
+
 class Order(models.Model):
 	STATUS_CHOICES = [
 		('Pending', 'Pending'),
 		('Shipped', 'Shipped'),
 		('Delivered', 'Delivered'),
 	]
+	header = models.ForeignKey(OrderHeader, on_delete=models.CASCADE, related_name='lines')
 	buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
 	product = models.ForeignKey(Product, on_delete=models.CASCADE)
 	quantity = models.PositiveIntegerField()
+	# Price per unit when the order was placed; revenue never uses the live product price
+	unit_price = models.DecimalField(max_digits=10, decimal_places=2)
 	order_date = models.DateTimeField(auto_now_add=True)
 	status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
 
+	class Meta:
+		indexes = [
+			# Purchased-product flags and review eligibility, read from the index alone
+			models.Index(fields=['buyer', 'product']),
+		]
+
 	def __str__(self):
 		return f"Order #{self.id} by {self.buyer.username}"
 
+	def get_total_price(self):
+		return self.unit_price * self.quantity
+
 class Wishlist(models.Model):
 	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wishlist')
 	product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='wishlisted_by')
@@ -102,19 +189,72 @@ class Review(models.Model):
 	def __str__(self):
 		return f"{self.buyer.username} - {self.product.name} ({self.rating} stars)"
 
+class OutboxEvent(models.Model):
+	# Something that should notify users, recorded in the same transaction as
+	# the change and turned into Notification rows by the dispatch_outbox
+	# worker; see outbox.py
+	KIND_CHOICES = [
+		('order_placed', 'Order placed'),
+		('direct_purchase', 'Direct purchase'),
+		('order_status', 'Order status changed'),
+	]
+	kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+	payload = models.JSONField(default=dict)
+	created_date = models.DateTimeField(auto_now_add=True)
+	# Set once delivered, or once given up on after too many failed attempts
+	processed_date = models.DateTimeField(null=True, blank=True)
+	attempts = models.PositiveSmallIntegerField(default=0)
+	last_error = models.TextField(blank=True)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['processed_date', 'id']),
+		]
+
+	def __str__(self):
+		return f"{self.get_kind_display()} #{self.id}"
+
 class Notification(models.Model):
 	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
 	message = models.TextField()
 	order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True, related_name='notifications')
+	order_header = models.ForeignKey(OrderHeader, on_delete=models.CASCADE, null=True, blank=True, related_name='notifications')
 	is_read = models.BooleanField(default=False)
 	created_date = models.DateTimeField(auto_now_add=True)
+	# Identifies the outbox delivery this came from, so redelivering an event never duplicates it
+	dedup_key = models.CharField(max_length=100, unique=True, null=True, blank=True)
 
 	class Meta:
 		ordering = ['-created_date']
+		indexes = [
+			# Inbox pages, newest first
+			models.Index(fields=['user', 'created_date']),
+			# Unread filter and mark-all-read
+			models.Index(fields=['user', 'is_read', 'created_date']),
+		]
 
 	def __str__(self):
 		return f"Notification for {self.user.username} - {'Read' if self.is_read else 'Unread'}"
 
+class ArchivedNotification(models.Model):
+	# Read notifications moved out of Notification by inbox.purge_read(archive=True)
+	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_notifications')
+	message = models.TextField()
+	created_date = models.DateTimeField()
+	archived_date = models.DateTimeField(auto_now_add=True)
+
+	def __str__(self):
+		return f"Archived notification for {self.user.username}"
+
+class NotificationCounter(models.Model):
+	# Denormalized count of the user's unread notifications, kept in step by
+	# inbox.py and rebuilt by the reconcile_notification_counters command
+	user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+	unread = models.PositiveIntegerField(default=0)
+
+	def __str__(self):
+		return f"{self.user.username}: {self.unread} unread"
+
 class Cart(models.Model):
 	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cart_items')
 	product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='in_carts')
@@ -129,3 +269,86 @@ class Cart(models.Model):
 
 	def get_total_price(self):
 		return self.product.price * self.quantity
+
+class SalesRollup(models.Model):
+	# One row per farmer, product, category and day, maintained by
+	# rollups.record_sale() in the same transaction as the order
+	farmer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sales_rollups')
+	product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sales_rollups')
+	category = models.CharField(max_length=50, choices=Product.CATEGORY_CHOICES)
+	day = models.DateField()
+	units_sold = models.PositiveIntegerField(default=0)
+	revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+	class Meta:
+		unique_together = ('farmer', 'product', 'category', 'day')
+		indexes = [
+			models.Index(fields=['farmer', 'day']),
+		]
+
+	def __str__(self):
+		return f"{self.product.name} on {self.day}: {self.units_sold} units"
+
+class StockHold(models.Model):
+	# Time-limited reservation of stock for a buyer's cart line; see inventory.py
+	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_holds')
+	product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_holds')
+	quantity = models.PositiveIntegerField()
+	expires_at = models.DateTimeField()
+
+	class Meta:
+		unique_together = ('user', 'product')
+		indexes = [
+			models.Index(fields=['product', 'expires_at']),
+			models.Index(fields=['expires_at']),
+		]
+
+	def __str__(self):
+		return f"{self.user.username} holds {self.quantity} of {self.product.name}"
+
+class IdempotencyKey(models.Model):
+	# First response to a keyed POST, replayed for retries until expires_at;
+	# see idempotency.py. status_code is null while the request is running.
+	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+	key = models.CharField(max_length=64)
+	path = models.CharField(max_length=255)
+	status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+	content_type = models.CharField(max_length=100, blank=True)
+	location = models.CharField(max_length=255, blank=True)
+	body = models.TextField(blank=True)
+	created_date = models.DateTimeField(auto_now_add=True)
+	expires_at = models.DateTimeField()
+
+	class Meta:
+		unique_together = ('user', 'key')
+		indexes = [
+			models.Index(fields=['expires_at']),
+		]
+
+	def __str__(self):
+		return f"{self.user.username} {self.path} [{self.key}]"
+
+class StoredFile(models.Model):
+	# One file written by ContentAddressedStorage, shared by every upload with
+	# the same content; deleted along with the file when references reaches 0
+	name = models.CharField(max_length=255, unique=True)
+	size = models.PositiveBigIntegerField()
+	references = models.PositiveIntegerField(default=1)
+	created_date = models.DateTimeField(auto_now_add=True)
+
+	def __str__(self):
+		return f"{self.name} ({self.references} references)"
+
+class ProductSearchEntry(models.Model):
+	# Row of the FTS5 word index kept by search.py, keyed by the product id as
+	# rowid; unmanaged, it only lets catalog queries join the index
+	product = models.OneToOneField(
+		Product, primary_key=True, db_column='rowid', db_constraint=False,
+		on_delete=models.DO_NOTHING, related_name='search_entry',
+	)
+	name = models.TextField()
+	category = models.TextField()
+
+	class Meta:
+		managed = False
+		db_table = 'marketplace_product_fts'
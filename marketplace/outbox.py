@@ -0,0 +1,177 @@
+"""Transactional outbox for notifications, drained at least once by dispatch_outbox."""
+from datetime import timedelta
+
+from django.db import OperationalError, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from . import inbox, live
+from .models import Order, OutboxEvent, Notification
+
+ORDER_PLACED = 'order_placed'
+DIRECT_PURCHASE = 'direct_purchase'
+ORDER_STATUS = 'order_status'
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+
+
+def record(kind, **payload):
+	"""Queue an event; call inside the transaction making the change it describes."""
+	return OutboxEvent.objects.create(kind=kind, payload=payload)
+
+
+def _order_header_notifications(events, describe):
+	# One notification per farmer per header, in line order
+	header_ids = {event.payload['order_header_id']: event for event in events}
+	lines = (
+		Order.objects.filter(header_id__in=header_ids)
+		.select_related('product', 'buyer')
+		.order_by('header_id', 'id')
+	)
+	by_header = {}
+	for line in lines:
+		by_header.setdefault(line.header_id, {}).setdefault(line.product.farmer_id, []).append(line)
+	for header_id, by_farmer in by_header.items():
+		event = header_ids[header_id]
+		for farmer_id, farmer_lines in by_farmer.items():
+			yield Notification(
+				user_id=farmer_id,
+				message=describe(header_id, farmer_lines),
+				order_header_id=header_id,
+				dedup_key=f'{event.id}:{farmer_id}',
+			)
+
+
+def _order_placed(events):
+	return _order_header_notifications(events, lambda header_id, lines: f"New order #{header_id}: " + ', '.join(
+		f"{line.product.name} ({line.quantity} units)" for line in lines
+	))
+
+
+def _direct_purchase(events):
+	return _order_header_notifications(events, lambda header_id, lines: (
+		f"{lines[0].buyer.username} ordered {lines[0].quantity} units of {lines[0].product.name}"
+	))
+
+
+def _order_status(events):
+	order_ids = {order_id for event in events for order_id in event.payload['order_ids']}
+	orders = Order.objects.filter(id__in=order_ids).select_related('product').in_bulk()
+	for event in events:
+		status = event.payload['status']
+		for order_id in event.payload['order_ids']:
+			order = orders.get(order_id)
+			if order is None:
+				continue
+			yield Notification(
+				user_id=order.buyer_id,
+				message=f"Your order #{order.id} for {order.product.name} is now {status}",
+				order=order,
+				dedup_key=f'{event.id}:{order.id}',
+			)
+
+
+RENDERERS = {
+	ORDER_PLACED: _order_placed,
+	DIRECT_PURCHASE: _direct_purchase,
+	ORDER_STATUS: _order_status,
+}
+
+
+def pending():
+	return OutboxEvent.objects.filter(processed_date__isnull=True).order_by('id')
+
+
+def _deliver(events):
+	"""Render and store notifications for events, then mark them processed. Returns the count stored."""
+	with transaction.atomic():
+		claimed = OutboxEvent.objects.filter(
+			id__in=[event.id for event in events], processed_date__isnull=True
+		).update(processed_date=timezone.now(), last_error='')
+		if not claimed:
+			return 0
+
+		by_kind = {}
+		for event in events:
+			by_kind.setdefault(event.kind, []).append(event)
+		notifications = [
+			notification
+			for kind, kind_events in by_kind.items()
+			for notification in RENDERERS[kind](kind_events)
+		]
+		# Skip anything an earlier delivery of the same events already stored
+		delivered = set(
+			Notification.objects.filter(dedup_key__in=[n.dedup_key for n in notifications])
+			.values_list('dedup_key', flat=True)
+		)
+		notifications = [n for n in notifications if n.dedup_key not in delivered]
+		Notification.objects.bulk_create(notifications)
+
+		user_ids = [notification.user_id for notification in notifications]
+		inbox.add_unread(user_ids)
+		live.changed(user_ids, live.NOTIFICATIONS)
+	return len(notifications)
+
+
+def _failed(events, error):
+	for event in events:
+		event.attempts += 1
+		event.last_error = f'{type(error).__name__}: {error}'
+		if event.attempts >= MAX_ATTEMPTS:
+			# Give up; processed_date with last_error set marks it as dead
+			event.processed_date = timezone.now()
+	OutboxEvent.objects.bulk_update(events, ['attempts', 'last_error', 'processed_date'])
+
+
+def dispatch(batch_size=BATCH_SIZE):
+	"""Deliver one batch of pending events. Returns (events handled, notifications created)."""
+	events = list(pending()[:batch_size])
+	if not events:
+		return 0, 0
+	try:
+		return len(events), _deliver(events)
+	except OperationalError:
+		# Locked or unavailable database: leave the batch for the next run
+		raise
+	except Exception as e:
+		if len(events) == 1:
+			_failed(events, e)
+			return 1, 0
+	# Isolate the event that broke the batch by retrying one at a time
+	created = 0
+	for event in events:
+		try:
+			created += _deliver([event])
+		except OperationalError:
+			raise
+		except Exception as e:
+			_failed([event], e)
+	return len(events), created
+
+
+def stats():
+	"""Return backlog depth, oldest pending age, drain rate over the last minute and dead event count."""
+	now = timezone.now()
+	backlog = pending()
+	oldest = backlog.aggregate(oldest=Min('created_date'))['oldest']
+	return {
+		'backlog': backlog.count(),
+		'oldest_pending_age_s': round((now - oldest).total_seconds(), 3) if oldest else 0,
+		'processed_last_minute': OutboxEvent.objects.filter(processed_date__gte=now - timedelta(minutes=1)).count(),
+		'dead': OutboxEvent.objects.filter(processed_date__isnull=False).exclude(last_error='').count(),
+	}
+
+
+def purge_processed(older_than, batch_size=1000):
+	"""Delete delivered events processed before now - older_than in batches, keeping dead ones. Returns how many."""
+	cutoff = timezone.now() - older_than
+	removed = 0
+	while True:
+		ids = list(
+			OutboxEvent.objects.filter(processed_date__lt=cutoff, last_error='')
+			.values_list('id', flat=True)[:batch_size]
+		)
+		if not ids:
+			return removed
+		removed += OutboxEvent.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,61 @@
+"""Keyset (cursor) pagination shared by the catalog and the admin tables."""
+import base64
+import json
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+	pass
+
+
+def encode_cursor(values):
+	raw = json.dumps([str(value) for value in values], separators=(',', ':'))
+	return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+	try:
+		padded = cursor + '=' * (-len(cursor) % 4)
+		values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+	except (ValueError, UnicodeDecodeError):
+		raise InvalidCursor('Malformed cursor')
+	if not isinstance(values, list) or len(values) != length:
+		raise InvalidCursor('Cursor does not match the sort order')
+	return values
+
+
+def after(ordering, values):
+	# (a, b) > (x, y)  ==  a > x OR (a = x AND b > y), honouring each field's direction
+	condition = Q()
+	for i, field in enumerate(ordering):
+		name = field.lstrip('-')
+		lookup = '__lt' if field.startswith('-') else '__gt'
+		step = Q(**{name + lookup: values[i]})
+		for prev_field, prev_value in zip(ordering[:i], values[:i]):
+			step &= Q(**{prev_field.lstrip('-'): prev_value})
+		condition |= step
+	return condition
+
+
+def sort_value(obj, field):
+	# Follow "farmer__username" style paths through related objects
+	for attr in field.lstrip('-').split('__'):
+		obj = getattr(obj, attr)
+	return obj
+
+
+def keyset_page(queryset, ordering, cursor=None, page_size=25):
+	"""Return (rows, next_cursor) for the page of queryset after cursor.
+
+	ordering must be total (end with the primary key) and have no nullable fields.
+	"""
+	queryset = queryset.order_by(*ordering)
+	if cursor:
+		queryset = queryset.filter(after(ordering, decode_cursor(cursor, len(ordering))))
+	rows = list(queryset[:page_size + 1])
+	next_cursor = None
+	if len(rows) > page_size:
+		rows = rows[:page_size]
+		next_cursor = encode_cursor([sort_value(rows[-1], field) for field in ordering])
+	return rows, next_cursor
@@ -0,0 +1,45 @@
+"""Cached per-buyer wishlist, purchased and reviewed product ids for product cards."""
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Wishlist, Order, Review
+
+CACHE_TIMEOUT = 60 * 60
+
+WISHLIST = 'wishlist'
+PURCHASED = 'purchased'
+REVIEWED = 'reviewed'
+
+# Part -> (context name, loader)
+PARTS = {
+	WISHLIST: ('wishlist_ids', lambda user_id: Wishlist.objects.filter(user_id=user_id).values_list('product_id', flat=True)),
+	PURCHASED: ('purchased_product_ids', lambda user_id: Order.objects.filter(buyer_id=user_id).values_list('product_id', flat=True).distinct()),
+	REVIEWED: ('reviewed_product_ids', lambda user_id: Review.objects.filter(buyer_id=user_id).values_list('product_id', flat=True)),
+}
+
+
+def _key(user_id, part):
+	return f'personalization:{user_id}:{part}'
+
+
+def get_flags(user):
+	"""Return {'wishlist_ids', 'purchased_product_ids', 'reviewed_product_ids'} as frozensets."""
+	keys = {part: _key(user.pk, part) for part in PARTS}
+	cached = cache.get_many(keys.values())
+	flags = {}
+	missing = {}
+	for part, (name, loader) in PARTS.items():
+		ids = cached.get(keys[part])
+		if ids is None:
+			ids = tuple(sorted(set(loader(user.pk))))
+			missing[keys[part]] = ids
+		flags[name] = frozenset(ids)
+	if missing:
+		cache.set_many(missing, CACHE_TIMEOUT)
+	return flags
+
+
+def invalidate(user_id, *parts):
+	"""Drop the given parts (all by default) once the current transaction commits."""
+	keys = [_key(user_id, part) for part in (parts or PARTS)]
+	transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,60 @@
+"""Order placement shared by checkout and the direct-buy form."""
+from django.db import transaction
+from django.db.models import F
+
+from . import inventory, outbox, rollups
+from .models import Product, OrderHeader, Order
+
+
+def take_stock(product_id, quantity, buyer=None):
+	"""Atomically decrement stock if quantity units remain beyond other buyers' holds."""
+	needed = inventory.held_by_others(product_id, buyer) + quantity
+	return Product.objects.filter(pk=product_id, quantity__gte=needed).update(
+		quantity=F('quantity') - quantity,
+		card_version=F('card_version') + 1,
+	) == 1
+
+
+def place_orders(buyer, lines, event=outbox.ORDER_PLACED):
+	"""Place one purchase of every (product, quantity) line that has stock.
+
+	Successful lines become Order rows under a single OrderHeader, priced at
+	the product's current price. An outbox event of kind event is recorded
+	so each farmer involved gets one notification. Returns (header, results):
+	header is None when no line could be ordered, and results holds one dict
+	per input line with an ok flag, the order (or None) and a message.
+	"""
+	results = []
+	with transaction.atomic():
+		for product, quantity in lines:
+			result = {'product': product, 'quantity': quantity, 'ok': False, 'order': None}
+			if quantity <= 0:
+				result['message'] = f'Invalid quantity for {product.name}'
+			elif take_stock(product.id, quantity, buyer):
+				result['ok'] = True
+				result['order'] = Order(buyer=buyer, product=product, quantity=quantity, unit_price=product.price)
+				result['message'] = f'Ordered {quantity} of {product.name}'
+			else:
+				result['message'] = f'Insufficient stock for {product.name}'
+			results.append(result)
+
+		orders = [result['order'] for result in results if result['ok']]
+		if not orders:
+			return None, results
+
+		header = OrderHeader.objects.create(
+			buyer=buyer,
+			line_count=len(orders),
+			total_amount=sum(order.get_total_price() for order in orders),
+		)
+		for order in orders:
+			order.header = header
+		# bulk_create fills in the primary keys on the same Order instances
+		Order.objects.bulk_create(orders)
+
+		inventory.release(buyer, [order.product_id for order in orders])
+		for order in orders:
+			rollups.record_sale(order)
+
+		outbox.record(event, order_header_id=header.id)
+	return header, results
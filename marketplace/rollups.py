@@ -0,0 +1,52 @@
+"""Daily sales rollups for the farmer dashboard."""
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import SalesRollup
+
+PERIODS = {
+	'day': None,
+	'week': TruncWeek,
+	'month': TruncMonth,
+}
+
+
+def record_sale(order):
+	"""Add one order to its rollup row, creating the row on the day's first sale."""
+	product = order.product
+	key = {
+		'farmer_id': product.farmer_id,
+		'product_id': product.id,
+		'category': product.category,
+		'day': timezone.localdate(order.order_date),
+	}
+	revenue = order.get_total_price()
+	increment = {'units_sold': F('units_sold') + order.quantity, 'revenue': F('revenue') + revenue}
+	if SalesRollup.objects.filter(**key).update(**increment):
+		return
+	try:
+		with transaction.atomic():
+			SalesRollup.objects.create(units_sold=order.quantity, revenue=revenue, **key)
+	except IntegrityError:
+		# Another transaction created the row first
+		SalesRollup.objects.filter(**key).update(**increment)
+
+
+def sales_series(farmer, period='day', days=30):
+	"""Return [{'period': date, 'units_sold': int, 'revenue': Decimal}, ...] oldest first."""
+	if period not in PERIODS:
+		raise ValueError(f'Unknown period: {period}')
+	since = timezone.localdate() - timedelta(days=days - 1)
+	rows = SalesRollup.objects.filter(farmer=farmer, day__gte=since)
+	trunc = PERIODS[period]
+	bucket = trunc('day') if trunc else F('day')
+	return list(
+		rows.annotate(period=bucket)
+		.values('period')
+		.annotate(units_sold=Sum('units_sold'), revenue=Sum('revenue'))
+		.order_by('period')
+	)
@@ -0,0 +1,178 @@
+"""Full-text product search backed by SQLite FTS5, with a trigram index for typos."""
+import re
+
+from django.db import connection
+from django.db.models import Case, F, FloatField, Func, IntegerField, Lookup, Q, When
+
+from .models import ProductSearchEntry
+
+FTS_TABLE = ProductSearchEntry._meta.db_table
+TRIGRAM_TABLE = 'marketplace_product_trigram'
+
+# Typo matches are scored in Python, so only this many trigram hits are considered
+FUZZY_CANDIDATES = 100
+# Share of query trigrams a product must contain to count as a fuzzy match
+MIN_TRIGRAM_SIMILARITY = 0.5
+
+# Column weights for bm25(): a name hit outranks a category hit
+NAME_WEIGHT = 10.0
+CATEGORY_WEIGHT = 2.0
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+CREATE_SQL = [
+	f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+	f"name, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')",
+	f"CREATE VIRTUAL TABLE IF NOT EXISTS {TRIGRAM_TABLE} USING fts5("
+	f"name, category, tokenize='trigram')",
+]
+DROP_SQL = [
+	f"DROP TABLE IF EXISTS {FTS_TABLE}",
+	f"DROP TABLE IF EXISTS {TRIGRAM_TABLE}",
+]
+
+
+def is_enabled(using=None):
+	return (using or connection).vendor == 'sqlite'
+
+
+def tokenize(query):
+	return [token.lower() for token in TOKEN_RE.findall(query or '')]
+
+
+def trigrams(tokens):
+	grams = []
+	for token in tokens:
+		for i in range(len(token) - 2):
+			gram = token[i:i + 3]
+			if gram not in grams:
+				grams.append(gram)
+	return grams
+
+
+def _quote(term):
+	return '"' + term.replace('"', '""') + '"'
+
+
+def index_product(product):
+	if not is_enabled():
+		return
+	with connection.cursor() as cursor:
+		for table in (FTS_TABLE, TRIGRAM_TABLE):
+			cursor.execute(f"DELETE FROM {table} WHERE rowid = %s", [product.pk])
+			cursor.execute(
+				f"INSERT INTO {table} (rowid, name, category) VALUES (%s, %s, %s)",
+				[product.pk, product.name, product.category],
+			)
+
+
+def remove_product(product_id):
+	if not is_enabled():
+		return
+	with connection.cursor() as cursor:
+		for table in (FTS_TABLE, TRIGRAM_TABLE):
+			cursor.execute(f"DELETE FROM {table} WHERE rowid = %s", [product_id])
+
+
+def rebuild_index(using=None):
+	"""Repopulate both index tables from marketplace_product; returns the row count."""
+	using = using or connection
+	if not is_enabled(using):
+		return 0
+	with using.cursor() as cursor:
+		for sql in CREATE_SQL:
+			cursor.execute(sql)
+		for table in (FTS_TABLE, TRIGRAM_TABLE):
+			cursor.execute(f"DELETE FROM {table}")
+			cursor.execute(
+				f"INSERT INTO {table} (rowid, name, category) "
+				f"SELECT id, name, category FROM marketplace_product"
+			)
+			cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+		cursor.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}")
+		return cursor.fetchone()[0]
+
+
+def _prefix_expression(tokens):
+	# Every token must match as a word prefix: "leaf spin" -> "leaf"* "spin"*
+	return ' '.join(_quote(token) + '*' for token in tokens)
+
+
+def _has_prefix_match(expression):
+	with connection.cursor() as cursor:
+		cursor.execute(f"SELECT 1 FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s LIMIT 1", [expression])
+		return cursor.fetchone() is not None
+
+
+def _fuzzy_matches(tokens, limit=FUZZY_CANDIDATES):
+	grams = trigrams(tokens)
+	if not grams:
+		return []
+	expression = ' OR '.join(_quote(gram) for gram in grams)
+	with connection.cursor() as cursor:
+		cursor.execute(
+			f"SELECT rowid, name, category FROM {TRIGRAM_TABLE} WHERE {TRIGRAM_TABLE} MATCH %s "
+			f"ORDER BY bm25({TRIGRAM_TABLE}, {NAME_WEIGHT}, {CATEGORY_WEIGHT}) LIMIT %s",
+			[expression, limit],
+		)
+		rows = cursor.fetchall()
+	matches = []
+	for rowid, name, category in rows:
+		text = f'{name} {category}'.lower()
+		shared = sum(1 for gram in grams if gram in text)
+		if shared / len(grams) >= MIN_TRIGRAM_SIMILARITY:
+			matches.append(rowid)
+	return matches
+
+
+class Match(Lookup):
+	# "<index> MATCH <query>" on the joined index row, across all its columns
+	lookup_name = 'match'
+
+	def as_sql(self, compiler, connection):
+		rhs, params = self.process_rhs(compiler, connection)
+		return f'{compiler.quote_name_unless_alias(self.lhs.alias)} MATCH {rhs}', params
+
+
+ProductSearchEntry._meta.get_field('name').register_lookup(Match)
+
+
+class Rank(Func):
+	# bm25() of the joined index row; lower is a better match
+	output_field = FloatField()
+
+	def as_sql(self, compiler, connection):
+		alias = compiler.quote_name_unless_alias(self.source_expressions[0].alias)
+		return f'bm25({alias}, {NAME_WEIGHT}, {CATEGORY_WEIGHT})', []
+
+
+def _join_matches(products, expression):
+	# Joined by rowid, so every match is ranked in the same query as the filter
+	return products.filter(search_entry__name__match=expression).annotate(search_rank=Rank(F('search_entry__name')))
+
+
+def _rank_ids(products, ranked_ids):
+	rank = Case(
+		*[When(id=product_id, then=position) for position, product_id in enumerate(ranked_ids)],
+		default=len(ranked_ids),
+		output_field=IntegerField(),
+	)
+	return products.filter(id__in=ranked_ids).annotate(search_rank=rank)
+
+
+def filter_products(products, query):
+	"""Narrow a Product queryset to query matches and return (queryset, ranked).
+
+	When ranked is true the queryset carries a search_rank annotation, lower
+	for better matches. It is false when the database has no FTS5 index and
+	the filter falls back to a plain icontains scan.
+	"""
+	if not is_enabled():
+		return products.filter(Q(name__icontains=query) | Q(category__icontains=query)), False
+	tokens = tokenize(query)
+	if not tokens:
+		return products.none(), False
+	expression = _prefix_expression(tokens)
+	if _has_prefix_match(expression):
+		return _join_matches(products, expression), True
+	return _rank_ids(products, _fuzzy_matches(tokens)), True
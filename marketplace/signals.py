@@ -0,0 +1,58 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from . import facets, metrics, personalization, search, thumbnails
+from .models import Order, OrderHeader, Product, Review
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+	# Count and time every query for the per-view metrics
+	metrics.instrument(connection)
+
+def release_image(storage, name, variants=None):
+	# Drop a product's reference to a stored photo once the change commits,
+	# and its thumbnails along with the last reference
+	if not name:
+		return
+	def release():
+		storage.delete(name)
+		if variants and not storage.exists(name):
+			thumbnails.delete_variants(name, variants)
+	transaction.on_commit(release)
+
+@receiver(pre_save, sender=Product)
+def release_replaced_image(sender, instance, update_fields=None, **kwargs):
+	if instance._state.adding or (update_fields is not None and 'image' not in update_fields):
+		return
+	previous = Product.objects.filter(pk=instance.pk).values('image', 'image_variants', 'image_variants_source').first()
+	if previous and previous['image'] and previous['image'] != instance.image.name:
+		variants = previous['image_variants'] if previous['image_variants_source'] == previous['image'] else None
+		release_image(instance.image.storage, previous['image'], variants)
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, **kwargs):
+	search.index_product(instance)
+	facets.invalidate()
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+	search.remove_product(instance.pk)
+	facets.invalidate()
+	variants = instance.image_variants if instance.image_variants_source == instance.image.name else None
+	release_image(instance.image.storage, instance.image.name, variants)
+
+@receiver(post_delete, sender=Review)
+def unrecord_deleted_review(sender, instance, **kwargs):
+	# Also runs for reviews cascaded away with their buyer, e.g. by admin_delete_user
+	Product.adjust_ratings(instance.product_id, -1, -instance.rating)
+	personalization.invalidate(instance.buyer_id, personalization.REVIEWED)
+
+@receiver(post_delete, sender=Order)
+def remove_deleted_line_from_header(sender, instance, **kwargs):
+	# Lines are cascaded away with their product; keep the header's totals in step
+	OrderHeader.objects.filter(pk=instance.header_id).update(
+		line_count=F('line_count') - 1,
+		total_amount=F('total_amount') - instance.get_total_price(),
+	)
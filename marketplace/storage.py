@@ -0,0 +1,118 @@
+"""Content-addressed file storage with reference counting."""
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+# Where uploads are spooled while hashed, inside the storage location so the
+# final move is a rename on the same filesystem
+INCOMING_DIR = '.incoming'
+
+
+def _stored_files():
+	# Looked up lazily: models.py creates this storage while it is being imported
+	return apps.get_model('marketplace', 'StoredFile').objects
+
+
+def content_name(directory, digest, extension):
+	"""Storage name for content with the given hex digest, e.g. product_images/ab/cd/abcd...ef.jpg."""
+	return posixpath.join(directory, digest[:2], digest[2:4], digest + extension.lower())
+
+
+def file_digest(storage, name):
+	"""SHA-256 hex digest of a stored file, read in chunks."""
+	digest = hashlib.sha256()
+	with storage.open(name, 'rb') as f:
+		for chunk in f.chunks():
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+	def get_available_name(self, name, max_length=None):
+		# The final name comes from the content in _save(); identical content
+		# is meant to land on the same name rather than get a suffix
+		return name
+
+	def _spool(self, content):
+		# Copy content to a temporary file, hashing it on the way
+		incoming = self.path(INCOMING_DIR)
+		os.makedirs(incoming, exist_ok=True)
+		fd, temp_path = tempfile.mkstemp(dir=incoming)
+		digest = hashlib.sha256()
+		size = 0
+		try:
+			with os.fdopen(fd, 'wb') as temp:
+				for chunk in content.chunks():
+					digest.update(chunk)
+					temp.write(chunk)
+					size += len(chunk)
+		except BaseException:
+			os.remove(temp_path)
+			raise
+		return temp_path, digest.hexdigest(), size
+
+	def _store(self, name, content, references=1):
+		directory, extension = posixpath.dirname(name), posixpath.splitext(name)[1]
+		temp_path, digest, size = self._spool(content)
+		try:
+			name = content_name(directory, digest, extension)
+			with transaction.atomic():
+				self._add_references(name, size, references)
+				path = self.path(name)
+				if not os.path.exists(path):
+					os.makedirs(os.path.dirname(path), exist_ok=True)
+					os.chmod(temp_path, self.file_permissions_mode or 0o644)
+					os.replace(temp_path, path)
+		finally:
+			if os.path.exists(temp_path):
+				os.remove(temp_path)
+		return name
+
+	def _add_references(self, name, size, references):
+		if _stored_files().filter(name=name).update(references=F('references') + references):
+			return
+		try:
+			with transaction.atomic():
+				_stored_files().create(name=name, size=size, references=references)
+		except IntegrityError:
+			# Stored concurrently by another upload of the same content
+			_stored_files().filter(name=name).update(references=F('references') + references)
+
+	def _save(self, name, content):
+		return self._store(name, content)
+
+	def adopt(self, name, references):
+		"""File an existing untracked file under its content name with the given
+		reference count, returning the new name. The original is left in place.
+		"""
+		with self.open(name, 'rb') as content:
+			return self._store(name, content, references)
+
+	def delete(self, name):
+		"""Drop one reference to name, removing the file with the last one."""
+		if not name:
+			raise ValueError('The name must be given to delete().')
+		with transaction.atomic():
+			stored = _stored_files().select_for_update().filter(name=name).first()
+			if stored is None:
+				return
+			if stored.references > 1:
+				_stored_files().filter(pk=stored.pk).update(references=F('references') - 1)
+				return
+			stored.delete()
+			super().delete(name)
+
+	def delete_untracked(self, name):
+		"""Remove a file this storage has no count for, such as one adopt() has copied."""
+		if not _stored_files().filter(name=name).exists():
+			super().delete(name)
+
+	def references(self, name):
+		stored = _stored_files().filter(name=name).first()
+		return stored.references if stored else 0
@@ -0,0 +1,116 @@
+"""Server-side paginated tables behind the admin summary page."""
+from django.db.models import Q
+
+from .models import UserProfile, Product, Order
+from .pagination import keyset_page
+
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+def _user_row(profile):
+	return {
+		'id': profile.id,
+		'user_id': profile.user.id,
+		'username': profile.user.username,
+		'email': profile.user.email,
+		'role': profile.role,
+		'date_joined': profile.user.date_joined.isoformat(),
+	}
+
+
+def _product_row(product):
+	return {
+		'id': product.id,
+		'name': product.name,
+		'farmer': product.farmer.username,
+		'category': product.category,
+		'price': str(product.price),
+		'quantity': product.quantity,
+	}
+
+
+def _order_row(order):
+	return {
+		'id': order.id,
+		'buyer': order.buyer.username,
+		'product': order.product.name,
+		'quantity': order.quantity,
+		'status': order.status,
+		'order_date': order.order_date.isoformat(),
+	}
+
+
+TABLES = {
+	'users': {
+		'queryset': lambda: UserProfile.objects.select_related('user'),
+		'sorts': {
+			'id': ('id',),
+			'username': ('user__username', 'id'),
+			'role': ('role', 'id'),
+			'date_joined': ('user__date_joined', 'id'),
+		},
+		'filters': {'role': 'role'},
+		'search': ('user__username__icontains', 'user__email__icontains'),
+		'row': _user_row,
+	},
+	'products': {
+		'queryset': lambda: Product.objects.select_related('farmer'),
+		'sorts': {
+			'id': ('id',),
+			'name': ('name', 'id'),
+			'category': ('category', 'id'),
+			'price': ('price', 'id'),
+			'quantity': ('quantity', 'id'),
+		},
+		'filters': {'category': 'category'},
+		'search': ('name__icontains', 'farmer__username__icontains'),
+		'row': _product_row,
+	},
+	'orders': {
+		'queryset': lambda: Order.objects.select_related('buyer', 'product'),
+		'sorts': {
+			'id': ('id',),
+			'order_date': ('order_date', 'id'),
+			'quantity': ('quantity', 'id'),
+			'status': ('status', 'id'),
+		},
+		'filters': {'status': 'status'},
+		'search': ('buyer__username__icontains', 'product__name__icontains'),
+		'row': _order_row,
+	},
+}
+
+
+def table_page(name, params):
+	"""Return (rows, next_cursor) for one page of a summary table.
+
+	Raises KeyError for an unknown table and pagination.InvalidCursor for a
+	cursor that does not belong to the requested sort.
+	"""
+	table = TABLES[name]
+	queryset = table['queryset']()
+
+	for param, field in table['filters'].items():
+		if params.get(param):
+			queryset = queryset.filter(**{field: params[param]})
+	search = params.get('q', '').strip()
+	if search:
+		condition = Q()
+		for lookup in table['search']:
+			condition |= Q(**{lookup: search})
+		queryset = queryset.filter(condition)
+
+	sort = params.get('sort', 'id')
+	descending = sort.startswith('-')
+	ordering = table['sorts'].get(sort.lstrip('-'), table['sorts']['id'])
+	if descending:
+		ordering = tuple('-' + field for field in ordering)
+
+	try:
+		page_size = min(max(int(params.get('page_size', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+	except ValueError:
+		page_size = PAGE_SIZE
+
+	rows, next_cursor = keyset_page(queryset, ordering, params.get('cursor'), page_size)
+	return [table['row'](row) for row in rows], next_cursor
@@ -1,4 +1,6 @@
 from django import template
+from marketplace.idempotency import new_key
+from marketplace.thumbnails import variant_urls
 
 register = template.Library()
 
@@ -11,3 +13,30 @@ def get_item(dictionary, key):
     if isinstance(dictionary, dict):
         return dictionary.get(key)
     return None
+
+@register.simple_tag
+def idempotency_key():
+    """
+    Fresh key for a purchase-style form, so a resubmitted form is not run twice.
+    Usage in template: <input type="hidden" name="idempotency_key" value="{% idempotency_key %}">
+    """
+    return new_key()
+
+@register.inclusion_tag('includes/responsive_image.html')
+def responsive_image(product, css_class='product-img', sizes='(max-width: 600px) 100vw, 320px'):
+    """
+    <picture> for a product photo: WebP and JPEG srcset lists from the resized
+    variants, or the original upload until they have been made.
+    Usage in template: {% responsive_image product "product-img" "(max-width: 600px) 100vw, 320px" %}
+    """
+    webp = variant_urls(product, 'webp')
+    jpeg = variant_urls(product, 'jpeg')
+    fallback = [url for width, url in jpeg if width <= 640]
+    return {
+        'product': product,
+        'css_class': css_class,
+        'sizes': sizes,
+        'webp_srcset': ', '.join(f'{url} {width}w' for width, url in webp),
+        'jpeg_srcset': ', '.join(f'{url} {width}w' for width, url in jpeg),
+        'src': fallback[-1] if fallback else (jpeg[0][1] if jpeg else product.image.url),
+    }
@@ -1,3 +1,1198 @@
-from django.test import TestCase
+import asyncio
+import io
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, OperationalError
+from django.db.models import Sum
+from django.template import Context, Template
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from PIL import Image
+
+from . import carts, catalog, exports, facets, idempotency, inbox, live, metrics, outbox, rollups, search, thumbnails
+from .models import UserProfile, Product, OrderHeader, Order, Review, Wishlist, Notification, NotificationCounter, OutboxEvent, ArchivedNotification, Cart, StockHold, StoredFile, IdempotencyKey, SalesRollup
+from .purchases import place_orders
+
+
+def setUpModule():
+	# The cache is a shared directory; give each run its own, so runs neither
+	# see each other's entries nor clear the development server's
+	location = tempfile.mkdtemp()
+	cache_settings = override_settings(CACHES={'default': {
+		'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+		'LOCATION': location,
+	}})
+	cache_settings.enable()
+	unittest.addModuleCleanup(shutil.rmtree, location)
+	unittest.addModuleCleanup(cache_settings.disable)
+
+
+def create_user(username, role):
+	user = User.objects.create_user(username=username)
+	UserProfile.objects.create(user=user, role=role)
+	return user
+
+
+class QueryBudgetMixin:
+	"""Fail a test when a view runs more queries than its budget, as an N+1 loop would."""
+
+	def assertQueryBudget(self, url, budget, method='get', **kwargs):
+		response = getattr(self.client, method)(url, **kwargs)
+		stats = response.wsgi_request.metrics
+		self.assertLessEqual(
+			stats.queries, budget,
+			f'{stats.view} ran {stats.queries} queries, over its budget of {budget}',
+		)
+		return response
+
+
+class FarmerAnalyticsTests(TestCase):
+	def setUp(self):
+		self.farmer = create_user('farmer', 'Farmer')
+		self.buyer = create_user('buyer', 'Buyer')
+		self.client.force_login(self.farmer)
+
+	def add_products(self, count, category='Spices & Herbs', price=10):
+		for i in range(count):
+			product = Product.objects.create(
+				name=f'Product {i}', category=category, price=price, quantity=100, farmer=self.farmer
+			)
+			place_orders(self.buyer, [(product, 2)])
+			place_orders(self.buyer, [(product, 3)])
+
+	def dashboard_queries(self):
+		with CaptureQueriesContext(connection) as context:
+			response = self.client.get(reverse('farmer_products'))
+		self.assertEqual(response.status_code, 200)
+		return len(context.captured_queries), response
+
+	def test_summary_figures(self):
+		self.add_products(2, category='Fruits - Berries', price=Decimal('12.50'))
+		self.add_products(1, category='Spices & Herbs', price=4)
+		_, response = self.dashboard_queries()
+		self.assertEqual(response.context['total_products_sold'], 15)
+		self.assertEqual(response.context['total_revenue'], Decimal('145.00'))
+		self.assertEqual(response.context['top_category'], 'Fruits - Berries')
+		self.assertEqual(set(response.context['total_sales'].values()), {5})
+
+	def test_query_count_does_not_grow_with_catalog(self):
+		self.add_products(1)
+		small, _ = self.dashboard_queries()
+		self.add_products(25)
+		large, _ = self.dashboard_queries()
+		self.assertEqual(small, large)
+
+
+class OrderHistoryTests(TestCase):
+	def test_deleted_products_leave_the_header_in_step(self):
+		farmer = create_user('farmer', 'Farmer')
+		buyer = create_user('buyer', 'Buyer')
+		products = [
+			Product.objects.create(name=name, category='Fruits - Berries', price=Decimal(price), quantity=10, farmer=farmer)
+			for name, price in (('Strawberries', '6.00'), ('Blueberries', '9.00'))
+		]
+		header, _ = place_orders(buyer, [(products[0], 2), (products[1], 1)])
+		products[1].delete()
+		header.refresh_from_db()
+		self.assertEqual((header.line_count, header.total_amount), (1, Decimal('12.00')))
+
+		self.client.force_login(buyer)
+		response = self.client.get(reverse('order_history'))
+		self.assertContains(response, 'rowspan="1"')
+		self.assertNotContains(response, 'rowspan="2"')
+
+
+class SalesRollupTests(TestCase):
+	TODAY = datetime(2026, 3, 18, 12, tzinfo=dt_timezone.utc)
+
+	def setUp(self):
+		self.farmer = create_user('farmer', 'Farmer')
+		self.buyer = create_user('buyer', 'Buyer')
+		self.rice = Product.objects.create(name='Rice', category='Grains & Cereals - Rice', price=Decimal('5.00'), quantity=100, farmer=self.farmer)
+		self.ghee = Product.objects.create(name='Ghee', category='Dairy Products - Butter', price=Decimal('20.00'), quantity=100, farmer=self.farmer)
+		# (days before today, [(product, quantity), ...])
+		for days_ago, lines in [
+			(0, [(self.rice, 2), (self.ghee, 1)]),
+			(0, [(self.rice, 1)]),
+			(2, [(self.rice, 3)]),
+			(8, [(self.rice, 1)]),
+			(19, [(self.ghee, 2)]),
+			(60, [(self.ghee, 5)]),
+		]:
+			with self.at(self.TODAY - timedelta(days=days_ago)):
+				place_orders(self.buyer, lines)
+
+	def at(self, moment):
+		return mock.patch('django.utils.timezone.now', return_value=moment)
+
+	def rollup_rows(self):
+		return sorted(SalesRollup.objects.values_list('product_id', 'category', 'day', 'units_sold', 'revenue'))
+
+	def test_rollups_match_orders(self):
+		expected = {}
+		for order in Order.objects.select_related('product'):
+			key = (order.product_id, order.product.category, order.order_date.date())
+			units, revenue = expected.get(key, (0, 0))
+			expected[key] = (units + order.quantity, revenue + order.get_total_price())
+		self.assertEqual(self.rollup_rows(), sorted(key + value for key, value in expected.items()))
+		self.assertEqual(SalesRollup.objects.filter(day=self.TODAY.date(), product=self.rice).get().units_sold, 3)
+
+	def test_series_buckets(self):
+		def series(period):
+			with self.at(self.TODAY):
+				return [(row['period'], row['units_sold'], row['revenue']) for row in rollups.sales_series(self.farmer, period, 30)]
+
+		self.assertEqual(series('day'), [
+			(date(2026, 2, 27), 2, Decimal('40.00')),
+			(date(2026, 3, 10), 1, Decimal('5.00')),
+			(date(2026, 3, 16), 3, Decimal('15.00')),
+			(date(2026, 3, 18), 4, Decimal('35.00')),
+		])
+		# Weeks start on Monday
+		self.assertEqual(series('week'), [
+			(date(2026, 2, 23), 2, Decimal('40.00')),
+			(date(2026, 3, 9), 1, Decimal('5.00')),
+			(date(2026, 3, 16), 7, Decimal('50.00')),
+		])
+		self.assertEqual(series('month'), [
+			(date(2026, 2, 1), 2, Decimal('40.00')),
+			(date(2026, 3, 1), 8, Decimal('55.00')),
+		])
+		with self.assertRaises(ValueError):
+			rollups.sales_series(self.farmer, 'year')
+
+	def test_rebuild_matches_incremental_rows(self):
+		incremental = self.rollup_rows()
+		SalesRollup.objects.update(units_sold=0, revenue=0)
+		call_command('rebuild_sales_rollups', stdout=io.StringIO())
+		self.assertEqual(self.rollup_rows(), incremental)
+		other = create_user('other', 'Farmer')
+		SalesRollup.objects.create(farmer=other, product=self.rice, category=self.rice.category, day=self.TODAY.date(), units_sold=9, revenue=1)
+		call_command('rebuild_sales_rollups', '--farmer', str(self.farmer.id), stdout=io.StringIO())
+		self.assertEqual(SalesRollup.objects.filter(farmer=other).count(), 1)
+
+	def test_series_endpoint(self):
+		url = reverse('sales_series')
+		self.client.force_login(self.buyer)
+		self.assertEqual(self.client.get(url).status_code, 403)
+		self.client.force_login(self.farmer)
+		with self.at(self.TODAY):
+			response = self.client.get(url, {'period': 'month', 'days': 30})
+		self.assertEqual(response.json()['series'], [
+			{'period': '2026-02-01', 'units_sold': 2, 'revenue': 40.0},
+			{'period': '2026-03-01', 'units_sold': 8, 'revenue': 55.0},
+		])
+		self.assertEqual(self.client.get(url, {'period': 'year'}).status_code, 400)
+		self.assertEqual(self.client.get(url, {'days': 'many'}).status_code, 400)
+
+
+class AdminSummaryTableTests(TestCase):
+	def setUp(self):
+		self.admin = create_user('admin', 'Admin')
+		self.farmers = [create_user(name, 'Farmer') for name in ('anand', 'bela')]
+		self.buyer = create_user('buyer', 'Buyer')
+		# Repeated prices so the id tie-break decides part of the order
+		for i, (price, category) in enumerate([
+			(30, 'Fruits - Seasonal'), (10, 'Spices & Herbs'), (20, 'Fruits - Seasonal'), (20, 'Spices & Herbs'),
+			(10, 'Fruits - Seasonal'), (40, 'Spices & Herbs'), (20, 'Fruits - Seasonal'),
+		]):
+			Product.objects.create(name=f'Item {i}', category=category, price=price, quantity=i, farmer=self.farmers[i % 2])
+		self.client.force_login(self.admin)
+
+	def page(self, table='products', **params):
+		response = self.client.get(reverse('admin_summary_table', args=[table]), params)
+		self.assertEqual(response.status_code, 200)
+		return response.json()
+
+	def all_pages(self, **params):
+		rows, cursor = [], None
+		while True:
+			data = self.page(**params, **({'cursor': cursor} if cursor else {}))
+			rows.extend(data['rows'])
+			cursor = data['next_cursor']
+			if cursor is None:
+				return rows
+
+	def test_sorted_pages_cover_every_row_once(self):
+		products = list(Product.objects.all())
+		for sort, key in [
+			('price', lambda p: (p.price, p.id)),
+			('-price', lambda p: (-p.price, -p.id)),
+			('name', lambda p: (p.name, p.id)),
+		]:
+			rows = self.all_pages(sort=sort, page_size=3)
+			self.assertEqual([row['id'] for row in rows], [p.id for p in sorted(products, key=key)], sort)
+		# Unknown sorts fall back to id
+		self.assertEqual([row['id'] for row in self.page(sort='farmer')['rows']], sorted(p.id for p in products))
+
+	def test_filters_and_search(self):
+		rows = self.all_pages(category='Spices & Herbs', sort='-price')
+		self.assertEqual([row['price'] for row in rows], ['40.00', '20.00', '10.00'])
+		rows = self.all_pages(q='BEL')
+		self.assertEqual({row['farmer'] for row in rows}, {'bela'})
+		self.assertEqual(len(rows), 3)
+		users = self.page('users', role='Farmer', sort='username')['rows']
+		self.assertEqual([row['username'] for row in users], ['anand', 'bela'])
+		self.assertEqual(self.page('users', q='buy')['rows'][0]['role'], 'Buyer')
+
+	def test_bad_cursor_is_rejected(self):
+		url = reverse('admin_summary_table', args=['products'])
+		self.assertEqual(self.client.get(url, {'cursor': 'not a cursor!'}).status_code, 400)
+		# A cursor from the id sort does not fit the price sort
+		cursor = self.page(page_size=2)['next_cursor']
+		self.assertEqual(self.client.get(url, {'cursor': cursor, 'sort': 'price'}).status_code, 400)
+
+	def test_unknown_table_and_access(self):
+		self.assertEqual(self.client.get(reverse('admin_summary_table', args=['payments'])).status_code, 404)
+		self.client.force_login(self.buyer)
+		self.assertEqual(self.client.get(reverse('admin_summary_table', args=['users'])).status_code, 403)
+		self.client.logout()
+		self.assertEqual(self.client.get(reverse('admin_summary_table', args=['users'])).status_code, 302)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+	stock = 50
+	threads = 16
+	attempts_per_thread = 10
+
+	def setUp(self):
+		self.farmer = create_user('farmer', 'Farmer')
+		self.product = Product.objects.create(
+			name='Mangoes', category='Fruits - Tropical', price=5, quantity=self.stock, farmer=self.farmer
+		)
+		self.buyers = [create_user(f'buyer{i}', 'Buyer') for i in range(self.threads)]
+
+	def run_buyers(self):
+		sold = []
+		lock_errors = []
+		errors = []
+		start = threading.Barrier(self.threads, timeout=30)
+
+		def buy(buyer):
+			try:
+				start.wait()
+				for _ in range(self.attempts_per_thread):
+					# No retry: the checkout view doesn't retry either, so a
+					# lock error here is a failed checkout for a real buyer
+					try:
+						_, (result,) = place_orders(buyer, [(self.product, 1)])
+					except OperationalError as e:
+						lock_errors.append(e)
+						continue
+					if result['ok']:
+						sold.append(1)
+			except Exception as e:
+				errors.append(e)
+			finally:
+				connection.close()
+
+		workers = [threading.Thread(target=buy, args=(buyer,)) for buyer in self.buyers]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+		return len(sold), lock_errors, errors
+
+	def test_no_oversell_under_concurrent_buyers(self):
+		sold, lock_errors, errors = self.run_buyers()
+		self.assertEqual(errors, [])
+		self.assertEqual(lock_errors, [])
+		self.product.refresh_from_db()
+		self.assertEqual(sold, self.stock)
+		self.assertEqual(self.product.quantity, 0)
+		self.assertEqual(Order.objects.filter(product=self.product).count(), self.stock)
+		while outbox.dispatch()[0]:
+			pass
+		self.assertEqual(Notification.objects.filter(user=self.farmer).count(), self.stock)
+
+
+class ConcurrentCartTests(TransactionTestCase):
+	stock = 20
+	threads = 8
+	adds_per_thread = 5
+
+	def setUp(self):
+		self.farmer = create_user('farmer', 'Farmer')
+		self.product = Product.objects.create(
+			name='Papayas', category='Fruits - Tropical', price=4, quantity=self.stock, farmer=self.farmer
+		)
+		self.buyers = [create_user(f'buyer{i}', 'Buyer') for i in range(self.threads)]
+
+	def test_concurrent_adds_never_fail_on_locks(self):
+		statuses = []
+		errors = []
+		start = threading.Barrier(self.threads, timeout=30)
+
+		def add(client):
+			try:
+				start.wait()
+				for _ in range(self.adds_per_thread):
+					# No retry: a buyer whose request fails sees the error
+					response = client.post(reverse('add_to_cart', args=[self.product.id]), {'quantity': 1})
+					statuses.append(response.status_code)
+			except Exception as e:
+				errors.append(e)
+			finally:
+				connection.close()
+
+		clients = []
+		for buyer in self.buyers:
+			client = Client()
+			client.force_login(buyer)
+			clients.append(client)
+		workers = [threading.Thread(target=add, args=(client,)) for client in clients]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+
+		self.assertEqual(errors, [])
+		self.assertEqual(len(statuses), self.threads * self.adds_per_thread)
+		# Every add either holds a unit or is refused for lack of stock
+		self.assertEqual(statuses.count(200), self.stock)
+		self.assertEqual(statuses.count(400), len(statuses) - self.stock)
+		self.assertEqual(StockHold.objects.filter(product=self.product).aggregate(total=Sum('quantity'))['total'], self.stock)
+		self.assertEqual(Cart.objects.filter(product=self.product).aggregate(total=Sum('quantity'))['total'], self.stock)
+
+
+class ExportTests(TestCase):
+	def test_csv_cells_cannot_start_formulas(self):
+		farmer = create_user('@farmer', 'Farmer')
+		Product.objects.create(name='=HYPERLINK("http://example.com")', category='Spices & Herbs', price=Decimal('2.50'), quantity=3, farmer=farmer)
+		queryset = exports.export_queryset('products', {})
+		lines = list(exports.stream_rows('products', queryset, 'csv'))
+		self.assertEqual(lines[1].split(',')[1:3], ['"\'=HYPERLINK(""http://example.com"")"', 'Spices & Herbs'])
+		self.assertEqual([exports.csv_cell(value) for value in ('+1', '-1', 'Kale', -1)], ["'+1", "'-1", 'Kale', -1])
+		self.assertIn(",'@farmer", lines[1])
+		self.assertIn(',2.50,3,', lines[1])
+		ndjson = list(exports.stream_rows('products', queryset, 'ndjson'))
+		self.assertIn('"name": "=HYPERLINK', ndjson[0])
+
+
+class LiveBadgeTests(TestCase):
+	def setUp(self):
+		self.farmer = create_user('farmer', 'Farmer')
+		self.buyer = create_user('buyer', 'Buyer')
+		self.product = Product.objects.create(
+			name='Okra', category='Vegetables - Marrow', price=3, quantity=10, farmer=self.farmer
+		)
+
+	def test_changes_are_published_after_commit(self):
+		published = []
+		original = live.hub.publish
+		live.hub.publish = lambda user_id, topic: published.append((user_id, topic))
+		try:
+			place_orders(self.buyer, [(self.product, 1)])
+			with self.captureOnCommitCallbacks() as callbacks:
+				outbox.dispatch()
+				self.assertEqual(published, [])
+			for callback in callbacks:
+				callback()
+		finally:
+			live.hub.publish = original
+		self.assertEqual(published, [(self.farmer.id, live.NOTIFICATIONS)])
+
+	def test_wsgi_request_is_told_to_stop_reconnecting(self):
+		self.client.force_login(self.buyer)
+		response = self.client.get(reverse('live_badges'))
+		self.assertEqual(response.status_code, 204)
+
+	async def test_stream_pushes_counts_when_they_change(self):
+		await self.async_client.aforce_login(self.buyer)
+		response = await self.async_client.get(reverse('live_badges'))
+		self.assertEqual(response['Content-Type'], 'text/event-stream')
+		stream = aiter(response.streaming_content)
+		self.assertTrue((await anext(stream)).startswith(b'retry:'))
+		self.assertIn(b'"cart_count": 0', await anext(stream))
+
+		await Cart.objects.acreate(user=self.buyer, product=self.product, quantity=2)
+		live.hub.publish(self.buyer.id, live.CART)
+		event = await anext(stream)
+		self.assertIn(b'"cart_count": 1', event)
+		self.assertNotIn(b'unread_count', event)
+
+	async def test_notifications_from_the_outbox_worker_reach_open_streams(self):
+		await self.async_client.aforce_login(self.farmer)
+		# dispatch_outbox runs in its own process, so nothing it publishes reaches this hub
+		with mock.patch.object(live, 'RECHECK', 0.01), mock.patch.object(live.hub, 'publish'):
+			response = await self.async_client.get(reverse('live_badges'))
+			stream = aiter(response.streaming_content)
+			await anext(stream)
+			self.assertIn(b'"unread_count": 0', await anext(stream))
+
+			await sync_to_async(place_orders)(self.buyer, [(self.product, 1)])
+			await sync_to_async(call_command)('dispatch_outbox', stdout=io.StringIO())
+			event = await asyncio.wait_for(anext(stream), 5)
+		self.assertEqual(event, live.sse_event({'unread_count': 1}).encode())
+
+	async def test_hub_delivers_until_unsubscribed(self):
+		with live.hub.subscribe(self.buyer.id) as queue:
+			self.assertEqual(live.hub.subscriber_count(self.buyer.id), 1)
+			live.hub.publish(self.buyer.id, live.NOTIFICATIONS)
+			self.assertEqual(await queue.get(), live.NOTIFICATIONS)
+		self.assertEqual(live.hub.subscriber_count(self.buyer.id), 0)
+
+
+class NotificationCounterTests(TestCase):
+	def setUp(self):
+		self.farmer = create_user('farmer', 'Farmer')
+		self.buyer = create_user('buyer', 'Buyer')
+		self.products = [
+			Product.objects.create(name=f'Beans {i}', category='Pulses & Legumes - Beans', price=4, quantity=20, farmer=self.farmer)
+			for i in range(3)
+		]
+
+	def unread(self, user):
+		return inbox.unread_count(user.id)
+
+	def test_counters_follow_notifications(self):
+		header, _ = place_orders(self.buyer, [(product, 1) for product in self.products])
+		place_orders(self.buyer, [(self.products[0], 1)])
+		outbox.dispatch()
+		self.assertEqual(self.unread(self.farmer), 2)
+
+		self.client.force_login(self.farmer)
+		response = self.client.post(reverse('bulk_update_order_status'), {
+			'status': 'Shipped', 'order_ids': list(header.lines.values_list('id', flat=True)),
+		})
+		self.assertEqual(response.status_code, 200)
+		outbox.dispatch()
+		self.assertEqual(self.unread(self.buyer), 3)
+
+		self.client.force_login(self.buyer)
+		with self.assertNumQueries(3):
+			# Session, user and the counter lookup
+			response = self.client.get(reverse('get_notification_count'))
+		self.assertEqual(response.json(), {'unread_count': 3})
+
+		self.client.post(reverse('notifications'))
+		self.assertEqual(self.unread(self.buyer), 0)
+		self.assertEqual(self.unread(self.farmer), 2)
+
+	def test_reconcile_corrects_drift(self):
+		place_orders(self.buyer, [(self.products[0], 1)])
+		outbox.dispatch()
+		NotificationCounter.objects.filter(pk=self.farmer.pk).update(unread=7)
+		Notification.objects.create(user=self.buyer, message='Welcome')
+		self.assertEqual(inbox.reconcile(fix=False), 2)
+		self.assertEqual(inbox.reconcile(), 2)
+		self.assertEqual(self.unread(self.farmer), 1)
+		self.assertEqual(self.unread(self.buyer), 1)
+		self.assertEqual(inbox.reconcile(), 0)
+
+
+class OutboxTests(TestCase):
+	def setUp(self):
+		self.farmers = [create_user(f'farmer{i}', 'Farmer') for i in range(2)]
+		self.buyer = create_user('buyer', 'Buyer')
+		self.products = [
+			Product.objects.create(name=f'Rice {i}', category='Grains & Cereals - Rice', price=8, quantity=20, farmer=farmer)
+			for i, farmer in enumerate(self.farmers)
+		]
+
+	def test_order_notifies_each_farmer_once_when_dispatched(self):
+		header, _ = place_orders(self.buyer, [(product, 2) for product in self.products])
+		self.assertFalse(Notification.objects.exists())
+		self.assertEqual(outbox.stats()['backlog'], 1)
+
+		self.assertEqual(outbox.dispatch(), (1, 2))
+		self.assertEqual(
+			sorted(Notification.objects.values_list('user_id', 'message')),
+			[(farmer.id, f'New order #{header.id}: {product.name} (2 units)') for farmer, product in zip(self.farmers, self.products)],
+		)
+		self.assertEqual(outbox.dispatch(), (0, 0))
+		self.assertEqual(outbox.stats()['backlog'], 0)
+
+	def test_redelivery_does_not_duplicate(self):
+		place_orders(self.buyer, [(self.products[0], 1)])
+		outbox.dispatch()
+		OutboxEvent.objects.update(processed_date=None)
+		self.assertEqual(outbox.dispatch(), (1, 0))
+		self.assertEqual(Notification.objects.count(), 1)
+		self.assertEqual(inbox.unread_count(self.farmers[0].id), 1)
+
+	def test_bad_event_does_not_block_the_batch(self):
+		outbox.record(outbox.ORDER_STATUS, status='Shipped')
+		place_orders(self.buyer, [(self.products[0], 1)])
+		self.assertEqual(outbox.dispatch(), (2, 1))
+		bad = OutboxEvent.objects.get(kind=outbox.ORDER_STATUS)
+		self.assertEqual(bad.attempts, 1)
+		self.assertIn('KeyError', bad.last_error)
+		self.assertIsNone(bad.processed_date)
+
+		for _ in range(outbox.MAX_ATTEMPTS - 1):
+			outbox.dispatch()
+		self.assertEqual(outbox.stats()['dead'], 1)
+		self.assertEqual(outbox.stats()['backlog'], 0)
+
+
+class InboxTests(TestCase):
+	def setUp(self):
+		self.user = create_user('buyer', 'Buyer')
+		self.client.force_login(self.user)
+
+	def add_notifications(self, count, is_read=False, age=timedelta(0)):
+		created = Notification.objects.bulk_create([
+			Notification(user=self.user, message=f'Message {i}', is_read=is_read) for i in range(count)
+		])
+		# Identical timestamps, so paging has to break ties on id
+		Notification.objects.filter(pk__in=[n.pk for n in created]).update(created_date=timezone.now() - age)
+		if not is_read:
+			inbox.add_unread([self.user.id] * count)
+		return created
+
+	def test_pages_cover_every_notification_once(self):
+		self.add_notifications(inbox.PAGE_SIZE * 2 + 5)
+		seen = []
+		cursor = None
+		while True:
+			response = self.client.get(reverse('notifications'), {'cursor': cursor} if cursor else {})
+			seen.extend(n.pk for n in response.context['notifications'])
+			cursor = response.context['next_cursor']
+			if not cursor:
+				break
+		self.assertEqual(len(seen), inbox.PAGE_SIZE * 2 + 5)
+		self.assertEqual(seen, sorted(set(seen), reverse=True))
+
+	def test_mark_all_read_only_touches_unread_rows(self):
+		self.add_notifications(3, is_read=True)
+		self.add_notifications(2)
+		self.assertEqual(inbox.mark_all_read(self.user.id), 2)
+		self.assertEqual(inbox.unread_count(self.user.id), 0)
+		response = self.client.get(reverse('notifications'), {'unread': '1'})
+		self.assertEqual(list(response.context['notifications']), [])
+
+	def test_purge_keeps_unread_and_recent(self):
+		self.add_notifications(5, is_read=True, age=timedelta(days=100))
+		self.add_notifications(2, is_read=True)
+		self.add_notifications(1, age=timedelta(days=100))
+		self.assertEqual(inbox.purge_read(batch_size=2, archive=True), 5)
+		self.assertEqual(Notification.objects.filter(user=self.user).count(), 3)
+		self.assertEqual(ArchivedNotification.objects.filter(user=self.user).count(), 5)
+		self.assertEqual(inbox.purge_read(), 0)
+
+
+class IdempotencyTests(TestCase):
+	def setUp(self):
+		self.farmer = create_user('farmer', 'Farmer')
+		self.buyer = create_user('buyer', 'Buyer')
+		self.product = Product.objects.create(name='Maize', category='Grains & Cereals - Corn', price=Decimal('3.00'), quantity=10, farmer=self.farmer)
+		self.client.force_login(self.buyer)
+		self.key = idempotency.new_key()
+
+	def buy(self, key=None):
+		return self.client.post(reverse('buyer_dashboard'), {
+			'buy_product_id': self.product.id, 'quantity': 2, idempotency.FIELD: key or self.key,
+		})
+
+	def test_retry_replays_without_writing_orders(self):
+		first = self.buy()
+		with CaptureQueriesContext(connection) as queries:
+			retry = self.buy()
+		self.assertEqual((retry.status_code, retry['Location']), (first.status_code, first['Location']))
+		self.assertFalse([q['sql'] for q in queries if 'marketplace_order' in q['sql']])
+		self.assertEqual(Order.objects.count(), 1)
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.quantity, 8)
+
+	def test_request_in_flight_gets_conflict(self):
+		IdempotencyKey.objects.create(
+			user=self.buyer, key=self.key, path=reverse('buyer_dashboard'),
+			expires_at=timezone.now() + idempotency.LEASE,
+		)
+		self.assertEqual(self.buy().status_code, 409)
+		self.assertEqual(Order.objects.count(), 0)
+
+	def test_claim_left_by_a_crashed_request_is_reclaimed(self):
+		IdempotencyKey.objects.create(
+			user=self.buyer, key=self.key, path=reverse('buyer_dashboard'),
+			expires_at=timezone.now() - timedelta(seconds=1),
+		)
+		self.assertEqual(self.buy().status_code, 302)
+		self.assertEqual(Order.objects.count(), 1)
+		record = IdempotencyKey.objects.get(key=self.key)
+		self.assertEqual(record.status_code, 302)
+		self.assertGreater(record.expires_at, timezone.now() + idempotency.KEY_TTL - timedelta(minutes=1))
+
+	def test_key_reused_on_another_path(self):
+		self.buy()
+		response = self.client.post(reverse('add_to_cart', args=[self.product.id]), {
+			'quantity': 1, idempotency.FIELD: self.key,
+		})
+		self.assertEqual(response.status_code, 422)
+		self.assertFalse(Cart.objects.exists())
+
+	def test_expired_key_runs_again_and_is_purged(self):
+		self.buy()
+		IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+		self.buy()
+		self.assertEqual(Order.objects.count(), 2)
+		other = self.buy(idempotency.new_key())
+		self.assertEqual(other.status_code, 302)
+		IdempotencyKey.objects.filter(key=self.key).update(expires_at=timezone.now() - timedelta(seconds=1))
+		self.assertEqual(idempotency.purge_expired(), 1)
+		self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+
+class CartServiceTests(TestCase):
+	def setUp(self):
+		self.farmer = create_user('farmer', 'Farmer')
+		self.buyer = create_user('buyer', 'Buyer')
+		self.products = [
+			Product.objects.create(name=f'Peas {i}', category='Pulses & Legumes - Peas', price=Decimal('2.50') + i, quantity=10, farmer=self.farmer)
+			for i in range(5)
+		]
+		self.client.force_login(self.buyer)
+
+	def fill_cart(self, count):
+		for product in self.products[:count]:
+			carts.add(self.buyer, product.id, 2)
+
+	def test_cart_page_queries_do_not_grow_with_lines(self):
+		self.fill_cart(1)
+		with CaptureQueriesContext(connection) as small:
+			self.client.get(reverse('view_cart'))
+		self.fill_cart(5)
+		with CaptureQueriesContext(connection) as large:
+			response = self.client.get(reverse('view_cart'))
+		self.assertEqual(len(small), len(large))
+		# 4 * 2.50 for the product added twice, 2 * (3.50 + 4.50 + 5.50 + 6.50) for the rest
+		self.assertEqual(response.context['subtotal'], Decimal('50.00'))
+		self.assertEqual(response.context['total_items'], 12)
+
+	def test_checkout_is_all_or_nothing(self):
+		self.fill_cart(2)
+		with mock.patch('marketplace.views.personalization.invalidate', side_effect=RuntimeError('crashed')):
+			with self.assertRaises(RuntimeError):
+				self.client.post(reverse('checkout'))
+		self.assertFalse(Order.objects.exists())
+		self.assertEqual(Cart.objects.filter(user=self.buyer).count(), 2)
+		self.assertEqual(Product.objects.get(pk=self.products[0].pk).quantity, 10)
+
+		self.client.post(reverse('checkout'))
+		self.assertEqual(Order.objects.count(), 2)
+		self.assertFalse(Cart.objects.filter(user=self.buyer).exists())
+
+	def test_cart_changes_need_a_buyer(self):
+		self.fill_cart(1)
+		line = Cart.objects.get(user=self.buyer)
+		self.client.logout()
+		response = self.client.post(reverse('update_cart', args=[line.id]), {'quantity': 3})
+		self.assertEqual(response.status_code, 302)
+		self.client.force_login(self.farmer)
+		for url in (reverse('update_cart', args=[line.id]), reverse('remove_from_cart', args=[line.id])):
+			self.assertEqual(self.client.post(url, {'quantity': 3}).status_code, 403)
+		line.refresh_from_db()
+		self.assertEqual(line.quantity, 2)
+
+	def test_batch_is_all_or_nothing(self):
+		self.fill_cart(2)
+		first, second = Cart.objects.filter(user=self.buyer).order_by('id')
+		operations = [
+			{'op': 'remove', 'cart_id': first.id},
+			{'op': 'update', 'cart_id': second.id, 'quantity': 50},
+		]
+		response = self.client.post(reverse('update_cart_batch'), {'operations': operations}, content_type='application/json')
+		self.assertEqual(response.status_code, 400)
+		self.assertIn('Operation 2', response.json()['message'])
+		self.assertEqual(Cart.objects.filter(user=self.buyer).count(), 2)
+
+		operations[1]['quantity'] = 4
+		response = self.client.post(reverse('update_cart_batch'), {'operations': operations}, content_type='application/json')
+		self.assertEqual(response.json()['lines'], [{'cart_id': second.id, 'quantity': 4, 'item_total': 14.0}])
+		self.assertEqual(response.json()['subtotal'], 14.0)
+
+
+class CatalogProductsTests(TestCase):
+	def setUp(self):
+		# Cards and flags are cached by ids that earlier tests may have used
+		cache.clear()
+		self.farmer = create_user('farmer', 'Farmer')
+		self.buyer = create_user('buyer', 'Buyer')
+		self.products = [
+			Product.objects.create(name=name, category='Fruits - Tropical', price=Decimal('8.00'), quantity=20, farmer=self.farmer)
+			for name in ('Mango', 'Papaya', 'Guava')
+		]
+		Wishlist.objects.create(user=self.buyer, product=self.products[0])
+		place_orders(self.buyer, [(self.products[1], 1), (self.products[2], 1)])
+		Review.objects.create(buyer=self.buyer, product=self.products[1], rating=4)
+		self.client.force_login(self.buyer)
+
+	def get(self, **params):
+		return self.client.get(reverse('catalog_products'), params)
+
+	def test_pages_carry_flags_and_card_markup(self):
+		first = self.get(page_size=2).json()
+		self.assertTrue(first['success'])
+		cards = {card['name']: card for card in first['products']}
+		self.assertEqual(list(cards), ['Mango', 'Papaya'])
+		self.assertEqual(
+			[(card['wishlisted'], card['purchased'], card['reviewed']) for card in cards.values()],
+			[(True, False, False), (False, True, True)],
+		)
+		self.assertIn('<h4>Mango</h4>', cards['Mango']['html'])
+		self.assertIn('data-wishlisted="true"', cards['Mango']['html'])
+		self.assertIn('reviewed this product', cards['Papaya']['html'])
+
+		second = self.get(page_size=2, cursor=first['next_cursor']).json()
+		self.assertEqual([card['name'] for card in second['products']], ['Guava'])
+		guava = second['products'][0]
+		self.assertEqual((guava['wishlisted'], guava['purchased'], guava['reviewed']), (False, True, False))
+		self.assertIn('Leave a Review', guava['html'])
+		self.assertIsNone(second['next_cursor'])
+
+	def test_malformed_cursor(self):
+		response = self.get(cursor='%%%')
+		self.assertEqual(response.status_code, 400)
+		self.assertFalse(response.json()['success'])
+
+	def test_only_buyers(self):
+		self.client.force_login(self.farmer)
+		self.assertEqual(self.get().status_code, 403)
+
+
+class ReviewAggregateTests(TestCase):
+	def setUp(self):
+		self.farmer = create_user('farmer', 'Farmer')
+		self.buyers = [create_user(f'buyer{i}', 'Buyer') for i in range(2)]
+		self.product = Product.objects.create(name='Okra', category='Vegetables - Marrow', price=Decimal('4.00'), quantity=10, farmer=self.farmer)
+		for buyer in self.buyers:
+			place_orders(buyer, [(self.product, 1)])
+
+	def review(self, buyer, rating):
+		self.client.force_login(buyer)
+		response = self.client.post(reverse('submit_review', args=[self.product.id]), {'rating': rating})
+		self.assertEqual(response.status_code, 200)
+
+	def assertAggregates(self, count, total, avg):
+		self.product.refresh_from_db()
+		self.assertEqual((self.product.rating_count, self.product.rating_sum), (count, total))
+		self.assertAlmostEqual(self.product.rating_avg, avg)
+
+	def test_new_and_changed_reviews(self):
+		self.review(self.buyers[0], 5)
+		self.assertAggregates(1, 5, 5)
+		self.review(self.buyers[1], 2)
+		self.assertAggregates(2, 7, 3.5)
+		self.review(self.buyers[1], 4)
+		self.assertAggregates(2, 9, 4.5)
+
+	def test_deleted_reviews(self):
+		self.review(self.buyers[0], 5)
+		self.review(self.buyers[1], 2)
+		Review.objects.get(buyer=self.buyers[1]).delete()
+		self.assertAggregates(1, 5, 5)
+		# Cascaded with the buyer, as admin_delete_user does
+		self.buyers[0].delete()
+		self.assertAggregates(0, 0, 0)
+		self.assertEqual(self.product.average_rating, 0)
+
+	def test_rebuild_matches_reviews(self):
+		self.review(self.buyers[0], 3)
+		self.review(self.buyers[1], 4)
+		Product.objects.filter(pk=self.product.pk).update(rating_count=0, rating_sum=0, rating_avg=0)
+		version = Product.objects.get(pk=self.product.pk).card_version
+		call_command('rebuild_product_ratings', stdout=io.StringIO())
+		self.assertAggregates(2, 7, 3.5)
+		# Cached cards for the product must not keep showing the old rating
+		self.assertEqual(self.product.card_version, version + 1)
+		call_command('rebuild_product_ratings', stdout=io.StringIO())
+		self.assertAggregates(2, 7, 3.5)
+		self.assertEqual(self.product.card_version, version + 1)
+
+
+class SearchTests(TestCase):
+	def setUp(self):
+		self.farmer = create_user('farmer', 'Farmer')
+
+	def add(self, name, category='Vegetables - Leafy'):
+		return Product.objects.create(name=name, category=category, price=Decimal('10'), quantity=5, farmer=self.farmer)
+
+	def search(self, query):
+		products, ranked = search.filter_products(Product.objects.all(), query)
+		self.assertTrue(ranked)
+		return list(products.order_by(*catalog.SORTS['rank']).values_list('name', flat=True))
+
+	def test_index_follows_product_changes(self):
+		product = self.add('Spinach')
+		self.assertEqual(self.search('spinach'), ['Spinach'])
+		product.name = 'Kale'
+		product.save()
+		self.assertEqual(self.search('spinach'), [])
+		self.assertEqual(self.search('kale'), ['Kale'])
+		product.delete()
+		self.assertEqual(self.search('kale'), [])
+
+	def test_prefix_matching(self):
+		self.add('Baby Spinach')
+		self.add('Carrot', 'Vegetables - Root')
+		self.assertEqual(self.search('spin'), ['Baby Spinach'])
+		self.assertEqual(self.search('leaf spin'), ['Baby Spinach'])
+		self.assertEqual(self.search('roo'), ['Carrot'])
+
+	def test_name_match_outranks_category_match(self):
+		self.add('Rice Bran', 'Livestock - Cattle')
+		self.add('Basmati', 'Grains & Cereals - Rice')
+		self.assertEqual(self.search('rice'), ['Rice Bran', 'Basmati'])
+
+	def test_typo_matching(self):
+		self.add('Spinach')
+		self.add('Carrot', 'Vegetables - Root')
+		self.assertEqual(self.search('spinch'), ['Spinach'])
+		self.assertEqual(self.search('xyzzy'), [])
+
+	def test_broad_queries_return_every_match(self):
+		count = 1200
+		Product.objects.bulk_create([
+			Product(name=f'Tomato {i}', category='Fruits - Seasonal', price=Decimal(i % 90 + 1), quantity=5, farmer=self.farmer)
+			for i in range(count)
+		])
+		search.rebuild_index()
+		products, ranked = catalog.filter_products('tomato')
+		self.assertEqual(products.count(), count)
+		self.assertEqual(facets.category_counts('tomato', '', ''), {'Fruits - Seasonal': count})
+		self.assertEqual(sum(bucket['count'] for bucket in facets.price_histogram('tomato', '')), count)
+		seen, cursor = [], None
+		while True:
+			rows, cursor = catalog.paginate(products, catalog.resolve_sort('', ranked), cursor, catalog.MAX_PAGE_SIZE)
+			seen.extend(product.id for product in rows)
+			if cursor is None:
+				break
+		self.assertEqual(len(set(seen)), count)
+
+
+class ThumbnailTests(TestCase):
+	def setUp(self):
+		media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, media_root)
+		settings = override_settings(MEDIA_ROOT=media_root)
+		settings.enable()
+		self.addCleanup(settings.disable)
+		self.farmer = create_user('farmer', 'Farmer')
+
+	def upload(self, name, size=(500, 300), orientation=6, color=(200, 30, 30)):
+		# Landscape pixels, tagged to be displayed rotated 90 degrees
+		exif = Image.Exif()
+		exif[0x0112] = orientation
+		exif[0x010F] = 'Camera Maker'
+		buffer = io.BytesIO()
+		Image.new('RGB', size, color).save(buffer, 'JPEG', exif=exif)
+		return Product.objects.create(
+			name='Kale', category='Vegetables - Leafy', price=3, quantity=5, farmer=self.farmer,
+			image=SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg'),
+		)
+
+	def test_variants_are_upright_without_metadata(self):
+		product = self.upload('kale.jpg')
+		self.assertEqual(list(thumbnails.pending()), [product])
+		variants = thumbnails.render(product.image.name)
+		# Upright the photo is 300 wide, so no variant is wider than that
+		self.assertEqual(variants, {'webp': [160, 300], 'jpeg': [160, 300]})
+		self.assertTrue(thumbnails.record(product.id, product.image.name, variants))
+		self.assertFalse(thumbnails.pending().exists())
+
+		with default_storage.open(thumbnails.variant_name(product.image.name, 300, 'jpeg')) as f:
+			with Image.open(f) as image:
+				self.assertEqual(image.size, (300, 500))
+				self.assertEqual(len(image.getexif()), 0)
+
+	def test_stale_variants_are_not_recorded_or_used(self):
+		product = self.upload('kale.jpg')
+		source = product.image.name
+		variants = thumbnails.render(source)
+		# The farmer uploads a new photo while the old one is being processed
+		product = self.upload('kale-new.jpg', color=(30, 200, 30))
+		self.assertFalse(thumbnails.record(product.id, source, variants))
+		self.assertEqual(thumbnails.variant_urls(product, 'webp'), [])
+
+		html = Template('{% load custom_filters %}{% responsive_image product %}').render(Context({'product': product}))
+		self.assertIn(f'src="{product.image.url}"', html)
+		self.assertNotIn('srcset', html)
+
+	def test_responsive_image_srcset(self):
+		product = self.upload('kale.jpg', size=(1200, 800), orientation=1)
+		thumbnails.record(product.id, product.image.name, thumbnails.render(product.image.name))
+		product.refresh_from_db()
+		html = Template('{% load custom_filters %}{% responsive_image product %}').render(Context({'product': product}))
+		self.assertIn('type="image/webp"', html)
+		for width in thumbnails.WIDTHS:
+			self.assertIn(f'{width}w.webp {width}w', html)
+		self.assertIn('src="' + default_storage.url(thumbnails.variant_name(product.image.name, 640, 'jpeg')) + '"', html)
+
+
+class ContentAddressedStorageTests(TestCase):
+	def setUp(self):
+		media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, media_root)
+		settings = override_settings(MEDIA_ROOT=media_root)
+		settings.enable()
+		self.addCleanup(settings.disable)
+		self.farmer = create_user('farmer', 'Farmer')
+		self.storage = Product._meta.get_field('image').storage
+
+	def create_product(self, image):
+		return Product.objects.create(
+			name='Maize', category='Grains & Cereals - Corn', price=5, quantity=10, farmer=self.farmer, image=image,
+		)
+
+	def test_identical_uploads_are_stored_once(self):
+		first = self.create_product(SimpleUploadedFile('download.jpg', b'same photo'))
+		second = self.create_product(SimpleUploadedFile('download.jpg', b'same photo'))
+		other = self.create_product(SimpleUploadedFile('download.jpg', b'another photo'))
+		self.assertEqual(first.image.name, second.image.name)
+		self.assertNotEqual(first.image.name, other.image.name)
+		self.assertRegex(first.image.name, r'^product_images/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+		self.assertEqual(self.storage.references(first.image.name), 2)
+
+		name = first.image.name
+		with self.captureOnCommitCallbacks(execute=True):
+			first.delete()
+		self.assertEqual(self.storage.references(name), 1)
+		self.assertTrue(self.storage.exists(name))
+		with self.captureOnCommitCallbacks(execute=True):
+			second.delete()
+		self.assertFalse(StoredFile.objects.filter(name=name).exists())
+		self.assertFalse(self.storage.exists(name))
+
+	def test_replacing_an_image_releases_the_old_one(self):
+		product = self.create_product(SimpleUploadedFile('download.jpg', b'old photo'))
+		old_name = product.image.name
+		product.image = SimpleUploadedFile('download.jpg', b'new photo')
+		with self.captureOnCommitCallbacks(execute=True):
+			product.save()
+		self.assertFalse(self.storage.exists(old_name))
+		self.assertEqual(self.storage.references(product.image.name), 1)
+
+	def test_thumbnails_go_with_the_last_reference(self):
+		products = [self.create_product(SimpleUploadedFile('download.jpg', b'same photo')) for _ in range(3)]
+		name = products[0].image.name
+		variants = {'webp': [160, 320], 'jpeg': [160, 320]}
+		Product.objects.update(image_variants=variants, image_variants_source=name)
+		files = [thumbnails.variant_name(name, width, fmt) for fmt, widths in variants.items() for width in widths]
+		for variant in files:
+			default_storage.save(variant, ContentFile(b'variant'))
+
+		products = [Product.objects.get(pk=product.pk) for product in products]
+		with self.captureOnCommitCallbacks(execute=True):
+			products[0].delete()
+		self.assertTrue(all(default_storage.exists(variant) for variant in files))
+		products[1].image = SimpleUploadedFile('download.jpg', b'new photo')
+		with self.captureOnCommitCallbacks(execute=True):
+			products[1].save()
+		self.assertTrue(all(default_storage.exists(variant) for variant in files))
+		with self.captureOnCommitCallbacks(execute=True):
+			products[2].delete()
+		self.assertFalse(any(default_storage.exists(variant) for variant in files))
+
+	def test_dedupe_media_adopts_legacy_files(self):
+		# Files saved the old way, with random suffixes for repeated names
+		names = [
+			default_storage.save('product_images/download.jpg', ContentFile(content))
+			for content in (b'stock photo', b'stock photo', b'own photo')
+		]
+		orphan = default_storage.save('product_images/unused.jpg', ContentFile(b'stock photo'))
+		products = [self.create_product(name) for name in names + [names[0]]]
+		Product.objects.filter(pk=products[0].pk).update(image_variants={'jpeg': [160]}, image_variants_source=names[0])
+		default_storage.save(thumbnails.variant_name(names[0], 160, 'jpeg'), ContentFile(b'variant'))
+
+		call_command('dedupe_media', '--delete-orphans', stdout=io.StringIO())
+
+		products = [Product.objects.get(pk=product.pk) for product in products]
+		shared = products[0].image.name
+		self.assertEqual([product.image.name for product in products], [shared, shared, products[2].image.name, shared])
+		self.assertEqual(self.storage.references(shared), 3)
+		self.assertEqual(self.storage.references(products[2].image.name), 1)
+		for name in names + [orphan]:
+			self.assertFalse(default_storage.exists(name))
+		# The existing variant follows the image to its new name
+		self.assertEqual(products[0].image_variants_source, shared)
+		self.assertEqual(thumbnails.variant_urls(products[0], 'jpeg'), [
+			(160, default_storage.url(thumbnails.variant_name(shared, 160, 'jpeg')))
+		])
+		self.assertTrue(default_storage.exists(thumbnails.variant_name(shared, 160, 'jpeg')))
+		self.assertFalse(default_storage.exists(thumbnails.variant_name(names[0], 160, 'jpeg')))
+
+
+class QueryPlanTests(TestCase):
+	"""The hot views' queries must be answered from indexes, never by scanning a whole table."""
+
+	FARMERS = 4
+	BUYERS = 20
+	PRODUCTS_PER_FARMER = 150
+	ORDERS_PER_BUYER = 150
+
+	@classmethod
+	def setUpTestData(cls):
+		categories = [choice for choice, _ in Product.CATEGORY_CHOICES]
+		cls.farmers = [create_user(f'farmer{i}', 'Farmer') for i in range(cls.FARMERS)]
+		cls.buyers = [create_user(f'buyer{i}', 'Buyer') for i in range(cls.BUYERS)]
+		products = Product.objects.bulk_create(
+			Product(
+				name=f'Crop {farmer.id}-{i}', category=categories[i % len(categories)],
+				price=Decimal(1 + i % 97), quantity=1000, farmer=farmer,
+			)
+			for farmer in cls.farmers for i in range(cls.PRODUCTS_PER_FARMER)
+		)
+		headers = OrderHeader.objects.bulk_create(OrderHeader(buyer=buyer) for buyer in cls.buyers)
+		orders = Order.objects.bulk_create(
+			Order(header=header, buyer=header.buyer, product=products[(header.id * 37 + i) % len(products)], quantity=1, unit_price=2)
+			for header in headers for i in range(cls.ORDERS_PER_BUYER)
+		)
+		Notification.objects.bulk_create(
+			Notification(user=order.buyer, message=f'Order #{order.id}', order=order, is_read=order.id % 3 == 0)
+			for order in orders
+		)
+		Cart.objects.bulk_create(
+			Cart(user=buyer, product=products[i * 11 + j]) for i, buyer in enumerate(cls.buyers) for j in range(5)
+		)
+		with connection.cursor() as cursor:
+			# Give the planner real statistics, as a long-running database would have
+			cursor.execute('ANALYZE')
+
+	def full_scans(self, queries):
+		scans = []
+		with connection.cursor() as cursor:
+			for query in queries:
+				sql = query['sql']
+				if not sql.lstrip().upper().startswith('SELECT'):
+					continue
+				cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+				plan = [row[-1] for row in cursor.fetchall()]
+				# Rows read in the requested order stop at the LIMIT; anything sorted afterwards was read in full
+				stops_early = re.search(r' LIMIT \d+$', sql) and 'USE TEMP B-TREE FOR ORDER BY' not in plan
+				for detail in plan:
+					# A table walked directly or through an index that doesn't cover the query;
+					# covering index scans, subqueries and virtual tables are fine
+					if re.fullmatch(r'SCAN \w+( USING INDEX \w+)?', detail) and not stops_early:
+						scans.append(f'{detail}: {sql}')
+		return scans
+
+	def assertNoFullScans(self, user, *urls):
+		self.client.force_login(user)
+		for url in urls:
+			with self.subTest(url=url):
+				with CaptureQueriesContext(connection) as context:
+					response = self.client.get(url)
+				self.assertEqual(response.status_code, 200)
+				self.assertEqual(self.full_scans(context.captured_queries), [])
+
+	def test_catalog(self):
+		category = Product.CATEGORY_CHOICES[3][0]
+		self.assertNoFullScans(
+			self.buyers[0],
+			reverse('buyer_dashboard'),
+			reverse('buyer_dashboard') + f'?category={category}&sort=price',
+			reverse('catalog_products') + '?sort=-price',
+			reverse('catalog_products') + f'?category={category}&sort=-price&min_price=10',
+		)
+
+	def test_buyer_pages(self):
+		self.assertNoFullScans(
+			self.buyers[1],
+			reverse('order_history'),
+			reverse('view_cart'),
+			reverse('notifications'),
+			reverse('notifications') + '?unread=1',
+			reverse('get_cart_count'),
+			reverse('get_notification_count'),
+		)
+
+	def test_farmer_pages(self):
+		self.assertNoFullScans(self.farmers[2], reverse('farmer_products'), reverse('sales_series'))
+
+
+class MetricsTests(TestCase):
+	def setUp(self):
+		metrics.registry.reset()
+		self.buyer = create_user('buyer', 'Buyer')
+		self.admin = create_user('admin', 'Admin')
+
+	def test_requests_are_recorded_per_view(self):
+		self.client.force_login(self.buyer)
+		response = self.client.get(reverse('view_cart'))
+		self.assertEqual(response.wsgi_request.metrics.view, 'view_cart')
+		self.assertGreater(response.wsgi_request.metrics.queries, 0)
+		self.client.get('/no/such/page/')
+
+		self.client.force_login(self.admin)
+		body = self.client.get(reverse('metrics')).content.decode()
+		self.assertIn('marketplace_requests_total{view="view_cart",method="GET",status="200"} 1', body)
+		self.assertIn('marketplace_requests_total{view="unmatched",method="GET",status="404"} 1', body)
+		self.assertIn('marketplace_request_duration_seconds_bucket{view="view_cart",le="+Inf"} 1', body)
+		self.assertIn(f'marketplace_db_queries_sum{{view="view_cart"}} {response.wsgi_request.metrics.queries}', body)
+		self.assertIn(f'marketplace_response_size_bytes_sum{{view="view_cart"}} {len(response.content)}', body)
+		self.assertIn('marketplace_outbox_backlog 0', body)
+
+	def test_metrics_are_admin_only(self):
+		self.client.force_login(self.buyer)
+		self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+	def test_queries_outside_requests_are_not_recorded(self):
+		self.assertIn(metrics.record_query, connection.execute_wrappers)
+		Product.objects.count()
+		self.assertEqual(metrics.registry.requests, {})
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+	"""Query budgets for the busiest views, checked with enough rows that a per-row query would blow them."""
+
+	BUDGETS = {
+		'buyer_dashboard': 9,
+		'catalog_products': 4,
+		'order_history': 6,
+		'view_cart': 4,
+		'checkout': 4,
+		'notifications': 5,
+		'farmer_products': 6,
+		'sales_series': 4,
+		'admin_summary': 4,
+	}
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.farmer = create_user('farmer', 'Farmer')
+		cls.buyer = create_user('buyer', 'Buyer')
+		cls.admin = create_user('admin', 'Admin')
+		products = [
+			Product.objects.create(name=f'Beans {i}', category='Pulses & Legumes - Beans', price=3 + i, quantity=100, farmer=cls.farmer)
+			for i in range(30)
+		]
+		for product in products[:10]:
+			carts.add(cls.buyer, product.id, 1)
+		for product in products[10:25]:
+			place_orders(cls.buyer, [(product, 1), (products[-1], 1)])
+		outbox.dispatch()
+
+	def test_buyer_views(self):
+		self.client.force_login(self.buyer)
+		for name in ('buyer_dashboard', 'catalog_products', 'order_history', 'view_cart', 'checkout', 'notifications'):
+			with self.subTest(view=name):
+				self.assertQueryBudget(reverse(name), self.BUDGETS[name])
+
+	def test_farmer_views(self):
+		self.client.force_login(self.farmer)
+		for name in ('farmer_products', 'sales_series', 'notifications'):
+			with self.subTest(view=name):
+				self.assertQueryBudget(reverse(name), self.BUDGETS[name])
+
+	def test_admin_views(self):
+		self.client.force_login(self.admin)
+		self.assertQueryBudget(reverse('admin_summary'), self.BUDGETS['admin_summary'])
@@ -0,0 +1,138 @@
+"""Resized WebP and JPEG copies of product photos for responsive images."""
+import io
+import logging
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.db.models import F
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = (160, 320, 640, 960)
+# Format -> (Pillow format, file extension, save options)
+FORMATS = {
+	'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+	'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+VARIANT_DIR = 'thumbnails'
+
+
+def variant_name(source, width, fmt):
+	"""Storage name of one variant, e.g. thumbnails/product_images/kale-320w.webp."""
+	stem = posixpath.splitext(source)[0]
+	return f'{VARIANT_DIR}/{stem}-{width}w.{FORMATS[fmt][1]}'
+
+
+def variant_urls(product, fmt):
+	"""Return [(width, url), ...] for the product's current image, empty until the variants are made."""
+	if not product.image or product.image_variants_source != product.image.name:
+		return []
+	return [
+		(width, default_storage.url(variant_name(product.image.name, width, fmt)))
+		for width in product.image_variants.get(fmt, [])
+	]
+
+
+def _flatten(image):
+	# JPEG has no alpha channel or palette; composite onto white
+	if image.mode in ('RGBA', 'LA', 'P'):
+		image = image.convert('RGBA')
+		background = Image.new('RGB', image.size, (255, 255, 255))
+		background.paste(image, mask=image.getchannel('A'))
+		return background
+	return image.convert('RGB')
+
+
+def render(source):
+	"""Write every variant of the stored image source. Returns {format: [widths]}.
+
+	Runs in pool workers, so it touches storage but never the database.
+	"""
+	with Product._meta.get_field('image').storage.open(source, 'rb') as f:
+		with Image.open(f) as original:
+			original = ImageOps.exif_transpose(original)
+			image = _flatten(original)
+	widths = [width for width in WIDTHS if width < image.width] or [image.width]
+	if image.width > widths[-1] and image.width <= WIDTHS[-1]:
+		# Keep a full-size copy when the original falls between two widths
+		widths.append(image.width)
+
+	variants = {}
+	for width in widths:
+		height = max(1, round(image.height * width / image.width))
+		resized = image.resize((width, height), Image.Resampling.LANCZOS)
+		for fmt, (pil_format, _, options) in FORMATS.items():
+			buffer = io.BytesIO()
+			# No exif= or icc_profile= is passed, so no metadata is written
+			resized.save(buffer, pil_format, **options)
+			name = variant_name(source, width, fmt)
+			if default_storage.exists(name):
+				default_storage.delete(name)
+			default_storage.save(name, ContentFile(buffer.getvalue()))
+			variants.setdefault(fmt, []).append(width)
+	return variants
+
+
+def copy_variants(old_source, new_source, variants):
+	"""Copy the variants of old_source to the names they have for new_source, unless already there."""
+	for fmt, widths in variants.items():
+		for width in widths:
+			old, new = variant_name(old_source, width, fmt), variant_name(new_source, width, fmt)
+			if default_storage.exists(old) and not default_storage.exists(new):
+				with default_storage.open(old, 'rb') as f:
+					default_storage.save(new, f)
+
+
+def delete_variants(source, variants):
+	for fmt, widths in variants.items():
+		for width in widths:
+			default_storage.delete(variant_name(source, width, fmt))
+
+
+def _render_or_none(source):
+	try:
+		return render(source)
+	except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+		logger.exception('Could not make variants of %s', source)
+		return None
+
+
+def pending():
+	"""Products with an image whose variants are missing or were made from an older image."""
+	return Product.objects.exclude(image__isnull=True).exclude(image='').exclude(image_variants_source=F('image'))
+
+
+def record(product_id, source, variants):
+	"""Store variants for source, unless the product's image has changed since. Returns True if stored."""
+	return Product.objects.filter(pk=product_id, image=source).update(
+		image_variants=variants or {},
+		image_variants_source=source,
+		card_version=F('card_version') + 1,
+	) == 1
+
+
+def process(products, workers=None):
+	"""Render variants for (id, image name) pairs in a process pool. Returns (done, failed)."""
+	done = failed = 0
+	products = list(products)
+	if not products:
+		return done, failed
+	# Workers are forked; don't let them inherit open database connections
+	connections.close_all()
+	with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+		results = pool.map(_render_or_none, [source for _, source in products])
+		for (product_id, source), variants in zip(products, results):
+			# Failures are recorded too, with no variants, so they are not retried forever
+			record(product_id, source, variants)
+			if variants is None:
+				failed += 1
+			else:
+				done += 1
+	return done, failed
@@ -10,6 +10,8 @@ urlpatterns = [
     path('register/', views.register, name='register'),
     path('logout/', views.logout_view, name='logout'),
     path('admin_summary/', views.admin_summary, name='admin_summary'),
+    path('admin_summary/<str:table>/', views.admin_summary_table, name='admin_summary_table'),
+    path('admin_export/<str:dataset>/', views.admin_export, name='admin_export'),
     path('password_change/', auth_views.PasswordChangeView.as_view(template_name='registration/password_change_form.html', success_url='/'), name='password_change'),
     path('farmer_products/', views.farmer_products, name='farmer_products'),
     path('add_product/', views.add_product, name='add_product'),
@@ -18,13 +20,19 @@ urlpatterns = [
     path('submit_review/<int:product_id>/', views.submit_review, name='submit_review'),
     path('notifications/', views.notifications, name='notifications'),
     path('get_notification_count/', views.get_notification_count, name='get_notification_count'),
+    path('live/badges/', views.live_badges, name='live_badges'),
     path('update_order_status/<int:order_id>/', views.update_order_status, name='update_order_status'),
+    path('bulk_update_order_status/', views.bulk_update_order_status, name='bulk_update_order_status'),
     path('admin_delete_user/<int:user_id>/', views.admin_delete_user, name='admin_delete_user'),
     path('admin_delete_product/<int:product_id>/', views.admin_delete_product, name='admin_delete_product'),
     path('add_to_cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('view_cart/', views.view_cart, name='view_cart'),
     path('update_cart/<int:cart_id>/', views.update_cart, name='update_cart'),
     path('remove_from_cart/<int:cart_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/batch/', views.update_cart_batch, name='update_cart_batch'),
     path('get_cart_count/', views.get_cart_count, name='get_cart_count'),
     path('checkout/', views.checkout, name='checkout'),
+    path('api/products/', views.catalog_products, name='catalog_products'),
+    path('api/sales_series/', views.sales_series, name='sales_series'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
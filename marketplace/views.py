@@ -1,12 +1,17 @@
+import json
+
 from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Sum, Avg
-from django.http import JsonResponse
+from django.db import transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse
 from .forms import LoginForm, RegistrationForm
-from .models import UserProfile, Product, Order, Wishlist, Review, Notification, Cart
+from .models import UserProfile, Product, OrderHeader, Order, Wishlist, Review, Cart
 from .product_form import ProductForm
+from .idempotency import idempotent
+from . import analytics, carts, catalog, exports, facets, fulfilment, inbox, live, metrics, outbox, pagination, personalization, purchases, rollups, summary_tables
 
 @login_required
 def admin_summary(request):
@@ -16,35 +21,66 @@ def admin_summary(request):
 		messages.error(request, 'Access denied. Only Admins can view this page.')
 		return redirect('login')
 
-	# Fetch all products with farmer data pre-fetched
-	products = Product.objects.select_related('farmer').all()
-	
-	# Fetch all orders with buyer and product data pre-fetched
-	orders = Order.objects.select_related('buyer', 'product').all()
+	# KPI counts come from one query; the tables load page by page from admin_summary_table
+	return render(request, 'admin_summary.html', {
+		**analytics.marketplace_totals(),
+		'category_choices': Product.CATEGORY_CHOICES,
+		'role_choices': UserProfile.ROLE_CHOICES,
+		'status_choices': Order.STATUS_CHOICES,
+	})
+
+@login_required
+def admin_summary_table(request, table):
+	user = request.user
+	if not hasattr(user, 'userprofile') or user.userprofile.role != 'Admin':
+		return JsonResponse({'success': False, 'message': 'Only admins can view this table'}, status=403)
 	
-	# Get all users with their roles
-	users = UserProfile.objects.all().select_related('user')
-	farmers = users.filter(role='Farmer')
-	buyers = users.filter(role='Buyer')
+	try:
+		rows, next_cursor = summary_tables.table_page(table, request.GET)
+	except KeyError:
+		return JsonResponse({'success': False, 'message': 'Unknown table'}, status=404)
+	except pagination.InvalidCursor as e:
+		return JsonResponse({'success': False, 'message': str(e)}, status=400)
 	
-	total_transactions = orders.count()
+	return JsonResponse({'success': True, 'rows': rows, 'next_cursor': next_cursor})
 
-	# Count products by category
-	from django.db.models import Count
-	category_counts = dict(Product.objects.values_list('category').annotate(count=Count('id')))
+@login_required
+def admin_export(request, dataset):
+	user = request.user
+	if not hasattr(user, 'userprofile') or user.userprofile.role != 'Admin':
+		messages.error(request, 'Access denied. Only Admins can export data.')
+		return redirect('login')
+	
+	fmt = request.GET.get('format', 'csv')
+	if dataset not in exports.EXPORTS or fmt not in exports.FORMATS:
+		return HttpResponseBadRequest('Unknown export or format')
+	try:
+		queryset = exports.export_queryset(dataset, request.GET)
+	except ValueError as e:
+		return HttpResponseBadRequest(str(e))
+	
+	response = StreamingHttpResponse(exports.stream_rows(dataset, queryset, fmt), content_type=exports.FORMATS[fmt])
+	response['Content-Disposition'] = f'attachment; filename="{dataset}.{fmt}"'
+	return response
 
-	return render(request, 'admin_summary.html', {
-		'total_transactions': total_transactions,
-		'farmers': farmers,
-		'buyers': buyers,
-		'category_counts': category_counts,
-		'products': products,
-		'orders': orders,
-		'users': users,
-	})
-from django.db.models import Q
+@login_required
+def metrics_view(request):
+	# Prometheus scrape endpoint (see metrics.py); a plain 403 rather than a
+	# login redirect, since the client is a scraper
+	user = request.user
+	if not hasattr(user, 'userprofile') or user.userprofile.role != 'Admin':
+		return HttpResponseForbidden('Only admins can read metrics', content_type='text/plain')
+	outbox_stats = outbox.stats()
+	gauges = {
+		'outbox_backlog': ('Outbox events waiting to be delivered.', outbox_stats['backlog']),
+		'outbox_oldest_pending_age_seconds': ('Age of the oldest undelivered outbox event.', outbox_stats['oldest_pending_age_s']),
+		'outbox_dead_events': ('Outbox events given up on after repeated failures.', outbox_stats['dead']),
+		'live_badge_streams': ('Open live badge streams in this process.', live.hub.subscriber_count()),
+	}
+	return HttpResponse(metrics.registry.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @login_required
+@idempotent
 def buyer_dashboard(request):
 	user = request.user
 	# Ensure only buyers can access
@@ -52,65 +88,15 @@ def buyer_dashboard(request):
 		messages.error(request, 'Access denied. Only Buyers can view this page.')
 		return redirect('login')
 
-	query = request.GET.get('q', '')
-	category_filter = request.GET.get('category', '')
-	min_price = request.GET.get('min_price', '')
-	max_price = request.GET.get('max_price', '')
-	
-	products = Product.objects.all()
-	
-	# Apply text search filter
-	if query:
-		products = products.filter(Q(name__icontains=query) | Q(category__icontains=query))
-	
-	# Apply category filter
-	if category_filter:
-		products = products.filter(category=category_filter)
-	
-	# Apply price range filter
-	if min_price:
-		try:
-			products = products.filter(price__gte=float(min_price))
-		except ValueError:
-			pass
-	if max_price:
-		try:
-			products = products.filter(price__lte=float(max_price))
-		except ValueError:
-			pass
-	
-	# Get user's wishlist product IDs
-	wishlist_ids = Wishlist.objects.filter(user=user).values_list('product_id', flat=True)
-	
-	# Calculate average ratings for products
-	product_ratings = {}
-	for product in products:
-		avg_rating = Review.objects.filter(product=product).aggregate(Avg('rating'))['rating__avg']
-		product_ratings[product.id] = round(avg_rating, 1) if avg_rating else 0
-	
-	# Get products the user has ordered (for review eligibility)
-	purchased_product_ids = Order.objects.filter(buyer=user).values_list('product_id', flat=True).distinct()
-	
-	# Get products the user has already reviewed
-	reviewed_product_ids = Review.objects.filter(buyer=user).values_list('product_id', flat=True)
-
 	if request.method == 'POST' and 'buy_product_id' in request.POST:
 		product_id = request.POST.get('buy_product_id')
 		quantity = int(request.POST.get('quantity', 1))
 		try:
 			product = Product.objects.get(id=product_id)
-			if product.quantity >= quantity:
-				product.quantity -= quantity
-				product.save()
-				order = Order.objects.create(buyer=user, product=product, quantity=quantity)
-				
-				# Create notification for the farmer
-				Notification.objects.create(
-					user=product.farmer,
-					message=f"{user.username} ordered {quantity} units of {product.name}",
-					order=order
-				)
-				
+			# Stock is taken with a conditional UPDATE and the farmer notified (see purchases.py)
+			_, (result,) = purchases.place_orders(user, [(product, quantity)], outbox.DIRECT_PURCHASE)
+			if result['ok']:
+				personalization.invalidate(user.id, personalization.PURCHASED)
 				messages.success(request, f'Purchased {quantity} of {product.name}!')
 			else:
 				messages.error(request, 'Not enough stock available.')
@@ -118,6 +104,27 @@ def buyer_dashboard(request):
 			messages.error(request, 'Product not found.')
 		return redirect('buyer_dashboard')
 
+	query = request.GET.get('q', '')
+	category_filter = request.GET.get('category', '')
+	min_price = request.GET.get('min_price', '')
+	max_price = request.GET.get('max_price', '')
+	
+	# Apply search, category and price filters (see catalog.py)
+	products, ranked = catalog.filter_products(query, category_filter, min_price, max_price)
+	sort = catalog.resolve_sort(request.GET.get('sort', ''), ranked)
+	
+	# Only the first keyset page is rendered; the rest is fetched from catalog_products
+	try:
+		products, next_cursor = catalog.paginate(products, sort, request.GET.get('cursor'))
+	except catalog.InvalidCursor:
+		products, next_cursor = catalog.paginate(products, sort)
+	
+	# Per-category and price-bucket counts for the filter form (cached)
+	facet_counts = facets.compute_facets(query, category_filter, min_price, max_price)
+	
+	# Wishlist, purchased (for review eligibility) and reviewed product IDs
+	flags = personalization.get_flags(user)
+
 	return render(request, 'buyer_dashboard.html', {
 		'products': products,
 		'query': query,
@@ -125,10 +132,42 @@ def buyer_dashboard(request):
 		'min_price': min_price,
 		'max_price': max_price,
 		'category_choices': Product.CATEGORY_CHOICES,
-		'wishlist_ids': wishlist_ids,
-		'product_ratings': product_ratings,
-		'purchased_product_ids': purchased_product_ids,
-		'reviewed_product_ids': reviewed_product_ids,
+		'category_counts': facet_counts['categories'],
+		'price_buckets': facet_counts['prices'],
+		'sort': sort,
+		'sort_choices': catalog.SORT_CHOICES,
+		'next_cursor': next_cursor,
+		**flags,
+	})
+
+@login_required
+def catalog_products(request):
+	user = request.user
+	if not hasattr(user, 'userprofile') or user.userprofile.role != 'Buyer':
+		return JsonResponse({'success': False, 'message': 'Only buyers can browse the catalog'}, status=403)
+	
+	products, ranked = catalog.filter_products(
+		request.GET.get('q', ''),
+		request.GET.get('category', ''),
+		request.GET.get('min_price', ''),
+		request.GET.get('max_price', ''),
+	)
+	sort = catalog.resolve_sort(request.GET.get('sort', ''), ranked)
+	try:
+		page_size = min(max(int(request.GET.get('page_size', catalog.PAGE_SIZE)), 1), catalog.MAX_PAGE_SIZE)
+	except ValueError:
+		page_size = catalog.PAGE_SIZE
+	
+	try:
+		products, next_cursor = catalog.paginate(products, sort, request.GET.get('cursor'), page_size)
+	except catalog.InvalidCursor as e:
+		return JsonResponse({'success': False, 'message': str(e)}, status=400)
+	
+	flags = personalization.get_flags(user)
+	return JsonResponse({
+		'success': True,
+		'products': [catalog.product_card(product, flags, request) for product in products],
+		'next_cursor': next_cursor,
 	})
 
 # Buyer Order History View
@@ -138,7 +177,7 @@ def order_history(request):
 	if not hasattr(user, 'userprofile') or user.userprofile.role != 'Buyer':
 		messages.error(request, 'Access denied. Only Buyers can view this page.')
 		return redirect('login')
-	order_history = Order.objects.filter(buyer=user).select_related('product').order_by('-order_date')
+	order_history = OrderHeader.objects.filter(buyer=user).prefetch_related('lines__product').order_by('-created_date')
 	return render(request, 'order_history.html', {'order_history': order_history})
 
 
@@ -149,40 +188,44 @@ def farmer_products(request):
 	if not hasattr(user, 'userprofile') or user.userprofile.role != 'Farmer':
 		messages.error(request, 'Access denied. Only Farmers can view this page.')
 		return redirect('login')
-	products = Product.objects.filter(farmer=user)
-	total_sales = {}
-	total_products_sold = 0
-	total_revenue = 0
-	category_sales = {}
-	
-	for product in products:
-		product_sold = Order.objects.filter(product=product).aggregate(Sum('quantity'))['quantity__sum'] or 0
-		total_sales[product.id] = product_sold
-		total_products_sold += product_sold
-		
-		# Calculate revenue for this product
-		orders = Order.objects.filter(product=product)
-		for order in orders:
-			total_revenue += order.quantity * product.price
-		
-		# Track sales by category
-		if product.category not in category_sales:
-			category_sales[product.category] = 0
-		category_sales[product.category] += product_sold
+	products = list(Product.objects.filter(farmer=user))
 	
-	# Find top selling category
-	top_category = max(category_sales, key=category_sales.get) if category_sales else 'N/A'
+	# Units sold, revenue and top category from grouped queries (see analytics.py)
+	summary = analytics.farmer_summary(user, products)
 	
 	# Get orders for farmer's products
 	orders = Order.objects.filter(product__farmer=user).select_related('product', 'buyer').order_by('-order_date')
 	
 	return render(request, 'farmer_products.html', {
 		'products': products,
-		'total_sales': total_sales,
-		'total_products_sold': total_products_sold,
-		'total_revenue': total_revenue,
-		'top_category': top_category,
+		'total_sales': summary['total_sales'],
+		'total_products_sold': summary['total_products_sold'],
+		'total_revenue': summary['total_revenue'],
+		'top_category': summary['top_category'],
 		'orders': orders,
+		'status_choices': Order.STATUS_CHOICES,
+	})
+
+@login_required
+def sales_series(request):
+	user = request.user
+	if not hasattr(user, 'userprofile') or user.userprofile.role != 'Farmer':
+		return JsonResponse({'success': False, 'message': 'Only farmers can view sales'}, status=403)
+	
+	period = request.GET.get('period', 'day')
+	try:
+		days = min(max(int(request.GET.get('days', 30)), 1), 366 * 3)
+		series = rollups.sales_series(user, period, days)
+	except ValueError:
+		return JsonResponse({'success': False, 'message': 'Invalid period or days'}, status=400)
+	
+	return JsonResponse({
+		'success': True,
+		'period': period,
+		'series': [
+			{'period': row['period'].isoformat(), 'units_sold': row['units_sold'], 'revenue': float(row['revenue'])}
+			for row in series
+		],
 	})
 
 # Add New Product View
@@ -273,10 +316,12 @@ def toggle_wishlist(request, product_id):
 			if wishlist_item:
 				# Remove from wishlist
 				wishlist_item.delete()
+				personalization.invalidate(user.id, personalization.WISHLIST)
 				return JsonResponse({'success': True, 'action': 'removed', 'message': 'Removed from wishlist'})
 			else:
 				# Add to wishlist
 				Wishlist.objects.create(user=user, product=product)
+				personalization.invalidate(user.id, personalization.WISHLIST)
 				return JsonResponse({'success': True, 'action': 'added', 'message': 'Added to wishlist'})
 			
 		except Product.DoesNotExist:
@@ -304,16 +349,20 @@ def submit_review(request, product_id):
 			if rating < 1 or rating > 5:
 				return JsonResponse({'success': False, 'message': 'Rating must be between 1 and 5'}, status=400)
 			
-			# Create or update review
-			review, created = Review.objects.update_or_create(
-				buyer=user,
-				product=product,
-				defaults={'rating': rating, 'comment': comment}
-			)
+			# Create or update review and fold it into the product's stored aggregates
+			with transaction.atomic():
+				previous_rating = Review.objects.select_for_update().filter(
+					buyer=user, product=product
+				).values_list('rating', flat=True).first()
+				review, created = Review.objects.update_or_create(
+					buyer=user,
+					product=product,
+					defaults={'rating': rating, 'comment': comment}
+				)
+				product.record_rating(rating, None if created else previous_rating)
+				personalization.invalidate(user.id, personalization.REVIEWED)
 			
-			# Calculate new average rating
-			avg_rating = Review.objects.filter(product=product).aggregate(Avg('rating'))['rating__avg']
-			avg_rating = round(avg_rating, 1) if avg_rating else 0
+			avg_rating = product.average_rating
 			
 			action = 'submitted' if created else 'updated'
 			return JsonResponse({
@@ -333,11 +382,18 @@ def submit_review(request, product_id):
 @login_required
 def notifications(request):
 	user = request.user
-	notifications = Notification.objects.filter(user=user)
 	
 	# Mark all as read
 	if request.method == 'POST':
-		notifications.update(is_read=True)
+		inbox.mark_all_read(user.id)
+		live.changed([user.id], live.NOTIFICATIONS)
+		return redirect('notifications')
+	
+	# One keyset page at a time (see inbox.py)
+	unread_only = request.GET.get('unread') == '1'
+	try:
+		notifications, next_cursor = inbox.page(user.id, request.GET.get('cursor'), unread_only)
+	except pagination.InvalidCursor:
 		return redirect('notifications')
 	
 	# Determine user role for back button
@@ -345,43 +401,80 @@ def notifications(request):
 	
 	return render(request, 'notifications.html', {
 		'notifications': notifications,
+		'next_cursor': next_cursor,
+		'is_first_page': not request.GET.get('cursor'),
+		'unread_only': unread_only,
+		'unread_count': inbox.unread_count(user.id),
 		'user_role': user_role
 	})
 
 @login_required
 def get_notification_count(request):
 	user = request.user
-	unread_count = Notification.objects.filter(user=user, is_read=False).count()
+	unread_count = inbox.unread_count(user.id)
 	return JsonResponse({'unread_count': unread_count})
 
 @login_required
+async def live_badges(request):
+	# Server-Sent Events stream of badge counts (see live.py); only served
+	# under ASGI, since a WSGI worker would be tied up for the stream's life
+	if not isinstance(request, ASGIRequest):
+		return HttpResponse(status=204)
+	user = await request.auser()
+	response = StreamingHttpResponse(live.badge_stream(user.pk), content_type='text/event-stream')
+	response['Cache-Control'] = 'no-cache'
+	response['X-Accel-Buffering'] = 'no'
+	return response
+
+@login_required
+@idempotent
 def update_order_status(request, order_id):
 	if request.method == 'POST':
 		user = request.user
 		if not hasattr(user, 'userprofile') or user.userprofile.role != 'Farmer':
 			return JsonResponse({'success': False, 'message': 'Only farmers can update order status'}, status=403)
 		
-		try:
-			order = Order.objects.get(id=order_id, product__farmer=user)
-			new_status = request.POST.get('status')
-			
-			if new_status in dict(Order.STATUS_CHOICES):
-				order.status = new_status
-				order.save()
-				
-				# Create notification for the buyer
-				Notification.objects.create(
-					user=order.buyer,
-					message=f"Your order #{order.id} for {order.product.name} is now {new_status}",
-					order=order
-				)
-				
-				return JsonResponse({'success': True, 'status': new_status, 'message': 'Status updated successfully'})
-			else:
-				return JsonResponse({'success': False, 'message': 'Invalid status'}, status=400)
-			
-		except Order.DoesNotExist:
+		new_status = request.POST.get('status')
+		if new_status not in dict(Order.STATUS_CHOICES):
+			return JsonResponse({'success': False, 'message': 'Invalid status'}, status=400)
+		
+		results = fulfilment.set_status(user, [order_id], new_status)
+		if results[order_id] == fulfilment.NOT_FOUND:
 			return JsonResponse({'success': False, 'message': 'Order not found or access denied'}, status=404)
+		
+		return JsonResponse({'success': True, 'status': new_status, 'message': 'Status updated successfully'})
+	
+	return JsonResponse({'success': False, 'message': 'Invalid request'}, status=400)
+
+@login_required
+@idempotent
+def bulk_update_order_status(request):
+	if request.method == 'POST':
+		user = request.user
+		if not hasattr(user, 'userprofile') or user.userprofile.role != 'Farmer':
+			return JsonResponse({'success': False, 'message': 'Only farmers can update order status'}, status=403)
+		
+		new_status = request.POST.get('status')
+		if new_status not in dict(Order.STATUS_CHOICES):
+			return JsonResponse({'success': False, 'message': 'Invalid status'}, status=400)
+		
+		try:
+			order_ids = [int(order_id) for order_id in request.POST.getlist('order_ids')]
+		except ValueError:
+			return JsonResponse({'success': False, 'message': 'Invalid order id'}, status=400)
+		if not order_ids:
+			return JsonResponse({'success': False, 'message': 'No orders selected'}, status=400)
+		if len(order_ids) > fulfilment.MAX_BATCH:
+			return JsonResponse({'success': False, 'message': f'At most {fulfilment.MAX_BATCH} orders can be updated at once'}, status=400)
+		
+		results = fulfilment.set_status(user, order_ids, new_status)
+		updated = sum(1 for result in results.values() if result == fulfilment.UPDATED)
+		return JsonResponse({
+			'success': True,
+			'status': new_status,
+			'results': [{'order_id': order_id, 'result': result} for order_id, result in results.items()],
+			'message': f'{updated} order(s) updated to {new_status}',
+		})
 	
 	return JsonResponse({'success': False, 'message': 'Invalid request'}, status=400)
 
@@ -431,6 +524,7 @@ def admin_delete_product(request, product_id):
 	return redirect('admin_summary')
 
 @login_required
+@idempotent
 def add_to_cart(request, product_id):
 	if request.method == 'POST':
 		user = request.user
@@ -438,43 +532,20 @@ def add_to_cart(request, product_id):
 			return JsonResponse({'success': False, 'message': 'Only buyers can add to cart'}, status=403)
 		
 		try:
-			product = Product.objects.get(id=product_id)
 			quantity = int(request.POST.get('quantity', 1))
-			
-			if quantity <= 0:
-				return JsonResponse({'success': False, 'message': 'Invalid quantity'}, status=400)
-			
-			if quantity > product.quantity:
-				return JsonResponse({'success': False, 'message': f'Only {product.quantity} items available'}, status=400)
-			
-			# Check if item already in cart
-			cart_item, created = Cart.objects.get_or_create(
-				user=user,
-				product=product,
-				defaults={'quantity': quantity}
-			)
-			
-			if not created:
-				# Update quantity if already in cart
-				new_quantity = cart_item.quantity + quantity
-				if new_quantity > product.quantity:
-					return JsonResponse({'success': False, 'message': f'Cannot add more. Only {product.quantity} items available'}, status=400)
-				cart_item.quantity = new_quantity
-				cart_item.save()
-			
-			# Get cart count
-			cart_count = Cart.objects.filter(user=user).count()
-			
-			return JsonResponse({
-				'success': True,
-				'message': 'Added to cart successfully',
-				'cart_count': cart_count
-			})
-		
-		except Product.DoesNotExist:
-			return JsonResponse({'success': False, 'message': 'Product not found'}, status=404)
+			carts.add(user, product_id, quantity)
+		except ValueError:
+			return JsonResponse({'success': False, 'message': 'Invalid quantity'}, status=400)
+		except carts.CartError as e:
+			return JsonResponse({'success': False, 'message': e.message}, status=e.status)
 		except Exception as e:
 			return JsonResponse({'success': False, 'message': str(e)}, status=500)
+		
+		return JsonResponse({
+			'success': True,
+			'message': 'Added to cart successfully',
+			'cart_count': carts.totals(user)['cart_count']
+		})
 	
 	return JsonResponse({'success': False, 'message': 'Invalid request'}, status=400)
 
@@ -485,50 +556,40 @@ def view_cart(request):
 		messages.error(request, 'Access denied. Only Buyers can view cart.')
 		return redirect('login')
 	
-	cart_items = Cart.objects.filter(user=user).select_related('product')
-	
-	# Calculate totals
-	subtotal = sum(item.get_total_price() for item in cart_items)
-	total_items = sum(item.quantity for item in cart_items)
+	# Line totals and cart totals from one query (see carts.py)
+	cart_items = list(carts.lines(user))
+	totals = carts.totals(user, cart_items)
 	
 	return render(request, 'cart.html', {
 		'cart_items': cart_items,
-		'subtotal': subtotal,
-		'total_items': total_items,
+		'subtotal': totals['subtotal'],
+		'total_items': totals['total_items'],
 	})
 
 @login_required
 def update_cart(request, cart_id):
 	if request.method == 'POST':
 		user = request.user
+		if not hasattr(user, 'userprofile') or user.userprofile.role != 'Buyer':
+			return JsonResponse({'success': False, 'message': 'Only buyers can change the cart'}, status=403)
+		
 		try:
-			cart_item = Cart.objects.get(id=cart_id, user=user)
 			quantity = int(request.POST.get('quantity', 1))
-			
-			if quantity <= 0:
-				return JsonResponse({'success': False, 'message': 'Invalid quantity'}, status=400)
-			
-			if quantity > cart_item.product.quantity:
-				return JsonResponse({'success': False, 'message': f'Only {cart_item.product.quantity} items available'}, status=400)
-			
-			cart_item.quantity = quantity
-			cart_item.save()
-			
-			# Recalculate totals
-			cart_items = Cart.objects.filter(user=user)
-			subtotal = sum(item.get_total_price() for item in cart_items)
-			item_total = cart_item.get_total_price()
-			
-			return JsonResponse({
-				'success': True,
-				'item_total': float(item_total),
-				'subtotal': float(subtotal)
-			})
-		
-		except Cart.DoesNotExist:
-			return JsonResponse({'success': False, 'message': 'Cart item not found'}, status=404)
+			cart_item = carts.update(user, cart_id, quantity)
+		except ValueError:
+			return JsonResponse({'success': False, 'message': 'Invalid quantity'}, status=400)
+		except carts.CartError as e:
+			return JsonResponse({'success': False, 'message': e.message}, status=e.status)
 		except Exception as e:
 			return JsonResponse({'success': False, 'message': str(e)}, status=500)
+		
+		totals = carts.totals(user)
+		return JsonResponse({
+			'success': True,
+			'item_total': float(cart_item.get_total_price()),
+			'subtotal': float(totals['subtotal']),
+			'total_items': totals['total_items'],
+		})
 	
 	return JsonResponse({'success': False, 'message': 'Invalid request'}, status=400)
 
@@ -536,33 +597,65 @@ def update_cart(request, cart_id):
 def remove_from_cart(request, cart_id):
 	if request.method == 'POST':
 		user = request.user
+		if not hasattr(user, 'userprofile') or user.userprofile.role != 'Buyer':
+			return JsonResponse({'success': False, 'message': 'Only buyers can change the cart'}, status=403)
+		
 		try:
-			cart_item = Cart.objects.get(id=cart_id, user=user)
-			cart_item.delete()
-			
-			# Get updated cart count and subtotal
-			cart_items = Cart.objects.filter(user=user)
-			cart_count = cart_items.count()
-			subtotal = sum(item.get_total_price() for item in cart_items)
-			
-			return JsonResponse({
-				'success': True,
-				'cart_count': cart_count,
-				'subtotal': float(subtotal)
-			})
+			carts.remove(user, cart_id)
+		except carts.CartError as e:
+			return JsonResponse({'success': False, 'message': e.message}, status=e.status)
 		
-		except Cart.DoesNotExist:
-			return JsonResponse({'success': False, 'message': 'Cart item not found'}, status=404)
+		totals = carts.totals(user)
+		return JsonResponse({
+			'success': True,
+			'cart_count': totals['cart_count'],
+			'subtotal': float(totals['subtotal']),
+			'total_items': totals['total_items'],
+		})
+	
+	return JsonResponse({'success': False, 'message': 'Invalid request'}, status=400)
+
+@login_required
+@idempotent
+def update_cart_batch(request):
+	if request.method == 'POST':
+		user = request.user
+		if not hasattr(user, 'userprofile') or user.userprofile.role != 'Buyer':
+			return JsonResponse({'success': False, 'message': 'Only buyers can change the cart'}, status=403)
+		
+		try:
+			operations = json.loads(request.body).get('operations')
+		except (ValueError, AttributeError):
+			return JsonResponse({'success': False, 'message': 'Expected a JSON object with an operations list'}, status=400)
+		
+		try:
+			carts.apply(user, operations)
+		except carts.CartError as e:
+			return JsonResponse({'success': False, 'message': e.message}, status=e.status)
+		
+		cart_items = list(carts.lines(user))
+		totals = carts.totals(user, cart_items)
+		return JsonResponse({
+			'success': True,
+			'cart_count': totals['cart_count'],
+			'total_items': totals['total_items'],
+			'subtotal': float(totals['subtotal']),
+			'lines': [
+				{'cart_id': item.id, 'quantity': item.quantity, 'item_total': float(item.line_total)}
+				for item in cart_items
+			],
+		})
 	
 	return JsonResponse({'success': False, 'message': 'Invalid request'}, status=400)
 
 @login_required
 def get_cart_count(request):
 	user = request.user
-	cart_count = Cart.objects.filter(user=user).count()
+	cart_count = carts.totals(user)['cart_count']
 	return JsonResponse({'cart_count': cart_count})
 
 @login_required
+@idempotent
 def checkout(request):
 	user = request.user
 	if not hasattr(user, 'userprofile') or user.userprofile.role != 'Buyer':
@@ -570,50 +663,36 @@ def checkout(request):
 		return redirect('login')
 	
 	if request.method == 'POST':
-		cart_items = Cart.objects.filter(user=user).select_related('product')
-		
-		if not cart_items.exists():
-			messages.error(request, 'Your cart is empty.')
-			return redirect('view_cart')
-		
-		# Create orders for all items in cart
-		orders_created = []
-		for cart_item in cart_items:
-			# Check if sufficient stock
-			if cart_item.quantity > cart_item.product.quantity:
-				messages.error(request, f'Insufficient stock for {cart_item.product.name}')
-				continue
+		# Orders and the cart clear commit together; lines without stock stay in the cart
+		with transaction.atomic():
+			cart_items = list(Cart.objects.select_for_update().filter(user=user).select_related('product'))
+			if not cart_items:
+				messages.error(request, 'Your cart is empty.')
+				return redirect('view_cart')
 			
-			# Create order
-			order = Order.objects.create(
-				buyer=user,
-				product=cart_item.product,
-				quantity=cart_item.quantity
+			header, results = purchases.place_orders(
+				user, [(cart_item.product, cart_item.quantity) for cart_item in cart_items]
 			)
-			orders_created.append(order)
+			ordered_ids = [result['product'].id for result in results if result['ok']]
 			
-			# Reduce product quantity
-			cart_item.product.quantity -= cart_item.quantity
-			cart_item.product.save()
-			
-			# Create notification for farmer
-			Notification.objects.create(
-				user=cart_item.product.farmer,
-				message=f"New order #{order.id} for {cart_item.product.name} ({cart_item.quantity} units)",
-				order=order
-			)
+			# Clear exactly the lines that were read and ordered
+			if ordered_ids:
+				Cart.objects.filter(pk__in=[item.pk for item in cart_items if item.product_id in ordered_ids]).delete()
+				personalization.invalidate(user.id, personalization.PURCHASED)
+				live.changed([user.id], live.CART)
 		
-		# Clear cart
-		cart_items.delete()
+		for result in results:
+			if not result['ok']:
+				messages.error(request, result['message'])
 		
-		messages.success(request, f'{len(orders_created)} order(s) placed successfully!')
+		if header:
+			messages.success(request, f'Order #{header.id} placed successfully with {len(ordered_ids)} item(s)!')
 		return redirect('order_history')
 	
 	# GET request - show checkout confirmation
-	cart_items = Cart.objects.filter(user=user).select_related('product')
-	subtotal = sum(item.get_total_price() for item in cart_items)
+	cart_items = list(carts.lines(user))
 	
 	return render(request, 'checkout.html', {
 		'cart_items': cart_items,
-		'subtotal': subtotal,
+		'subtotal': carts.totals(user, cart_items)['subtotal'],
 	})